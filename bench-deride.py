@@ -0,0 +1,345 @@
+"""Benchmarks for Deride
+
+Run with `python bench-deride.py`, or `make bench`, from the root of the
+repository, deride is imported from the directory of the script.  With
+`--json PATH` the results are also written as JSON so that they can be
+compared across commits, `-` writes them to stdout.
+"""
+import argparse
+import json
+import platform
+import sys
+import threading
+import time
+import timeit
+
+from deride import Deride, Expectations, Invocation
+
+
+class Person(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def greet(self, other):
+        return 'hello ' + other.name
+
+    def pay(self, other, amount):
+        pass
+
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    """
+    Registers a benchmark function, each returns a list of result rows
+    """
+    BENCHMARKS.append(func)
+    return func
+
+
+def per_call(seconds, number):
+    """
+    Returns the cost of a single operation in microseconds
+    """
+    return seconds * 1e6 / number
+
+
+@benchmark
+def bench_notify():
+    """
+    Time to record N invocations, per call cost should stay flat as N grows
+    """
+    rows = []
+    invocation = Invocation('greet', 'alice')
+    for number in (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6):
+        def record(number=number):
+            expect = Expectations()
+            for _ in range(number):
+                expect.notify(invocation)
+        seconds = min(timeit.repeat(record, number=1, repeat=3))
+        rows.append(('notify', number, per_call(seconds, number)))
+    return rows
+
+
+@benchmark
+def bench_wrapped_notify():
+    """
+    Time to make N wrapped calls, per call cost should stay flat as N grows
+    """
+    rows = []
+    alice = Person('alice')
+    for number in (10 ** 3, 10 ** 4, 10 ** 5):
+        def record(number=number):
+            bob = Deride.wrap(Person('bob'))
+            for _ in range(number):
+                bob.greet(alice)
+        seconds = min(timeit.repeat(record, number=1, repeat=3))
+        rows.append(('wrapped notify', number, per_call(seconds, number)))
+    return rows
+
+
+@benchmark
+def bench_call_overhead():
+    """
+    Cost of a wrapped call compared with calling the target directly
+    """
+    number = 10 ** 5
+    alice = Person('alice')
+    direct = Person('bob')
+    wrapped = Deride.wrap(Person('bob'))
+    wrapped.greet(alice)
+    return [
+        ('direct call', number,
+         per_call(min(timeit.repeat(lambda: direct.greet(alice),
+                                    number=number, repeat=3)), number)),
+        ('wrapped call', number,
+         per_call(min(timeit.repeat(lambda: wrapped.greet(alice),
+                                    number=number, repeat=3)), number)),
+    ]
+
+
+@benchmark
+def bench_timeline():
+    """
+    Cost of a wrapped call recorded in the timeline of a Deride instance,
+    for each record mode, compared with one wrapped through the class
+    """
+    number = 10 ** 5
+    alice = Person('alice')
+    rows = []
+    wrapped = Deride.wrap(Person('bob'))
+    rows.append(('class wrapped call', number, per_call(min(timeit.repeat(
+        lambda: wrapped.greet(alice), number=number, repeat=3)), number)))
+    for record in ('full', 'last_n', 'counts'):
+        def call(record=record):
+            deride = Deride()
+            bob = deride.wrap(Person('bob'), record=record)
+            for _ in range(number):
+                bob.greet(alice)
+        seconds = min(timeit.repeat(call, number=1, repeat=3))
+        rows.append(('timeline call, {record}'.format(record=record),
+                     number, per_call(seconds, number)))
+    return rows
+
+
+@benchmark
+def bench_when_dispatch():
+    """
+    Cost of a wrapped call dispatched to one of 1, 100 or 10k when()
+    specifics, per call cost should stay flat as the specifics grow
+    """
+    rows = []
+    number = 10 ** 4
+    alice = Person('alice')
+    for specifics in (1, 100, 10 ** 4):
+        bob = Deride.wrap(Person('bob'))
+        for amount in range(specifics):
+            bob.setup.pay.when(alice, amount).to_return(amount)
+        last = specifics - 1
+        rows.append(('when dispatch x{specifics}'.format(specifics=specifics),
+                     number, per_call(min(timeit.repeat(
+                         lambda: bob.pay(alice, last),
+                         number=number, repeat=3)), number)))
+    return rows
+
+
+@benchmark
+def bench_with_args():
+    """
+    Cost of with_args and with_args_strict against a large invocation log
+    """
+    rows = []
+    alice = Person('alice')
+    for number in (10 ** 3, 10 ** 4, 10 ** 5):
+        bob = Deride.wrap(Person('bob'))
+        for amount in range(number):
+            bob.pay(alice, amount)
+        last = number - 1
+        rows.append(('with_args', number, per_call(min(timeit.repeat(
+            lambda: bob.expect.pay.called.with_args(last, alice),
+            number=10, repeat=3)), 10)))
+        rows.append(('with_args_strict', number, per_call(min(timeit.repeat(
+            lambda: bob.expect.pay.called.with_args_strict(alice, last),
+            number=10, repeat=3)), 10)))
+    return rows
+
+
+@benchmark
+def bench_threaded_notify():
+    """
+    Wrapped calls made from several threads sharing one wrapper, every call
+    must be recorded
+    """
+    rows = []
+    alice = Person('alice')
+    number = 10 ** 4
+    for threads in (1, 4, 16):
+        bob = Deride.wrap(Person('bob'), threadsafe=True)
+
+        def greet():
+            for _ in range(number):
+                bob.greet(alice)
+
+        def run(threads=threads):
+            workers = [threading.Thread(target=greet)
+                       for _ in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+        seconds = timeit.timeit(run, number=1)
+        bob.expect.greet.called.times(threads * number)
+        rows.append(('threaded notify x{threads}'.format(threads=threads),
+                     threads * number, per_call(seconds, threads * number)))
+    return rows
+
+
+@benchmark
+def bench_with_all():
+    """
+    Cost of checking many expected calls at once against a large log
+    """
+    rows = []
+    alice = Person('alice')
+    for number in (10 ** 3, 10 ** 4, 10 ** 5):
+        bob = Deride.wrap(Person('bob'))
+        for amount in range(number):
+            bob.pay(alice, amount)
+        expected = [(alice, amount) for amount in range(0, number, 10)]
+        rows.append(('with_all', number, per_call(min(timeit.repeat(
+            lambda: bob.expect.pay.called.with_all(expected),
+            number=1, repeat=3)), 1)))
+        rows.append(('with_sequence', number, per_call(min(timeit.repeat(
+            lambda: bob.expect.pay.called.with_sequence(expected),
+            number=1, repeat=3)), 1)))
+    return rows
+
+
+@benchmark
+def bench_stub():
+    """
+    Cost of creating and calling stubs compared with wrappers
+    """
+    number = 10 ** 4
+    alice = Person('alice')
+    stub = Deride.stub(Person)
+    wrapped = Deride.wrap(Person('bob'))
+    return [
+        ('create wrap', number, per_call(min(timeit.repeat(
+            lambda: Deride.wrap(alice), number=number, repeat=3)), number)),
+        ('create stub', number, per_call(min(timeit.repeat(
+            lambda: Deride.stub(Person), number=number, repeat=3)), number)),
+        ('wrapped call', number, per_call(min(timeit.repeat(
+            lambda: wrapped.greet(alice), number=number, repeat=3)), number)),
+        ('stub call', number, per_call(min(timeit.repeat(
+            lambda: stub.greet(alice), number=number, repeat=3)), number)),
+    ]
+
+
+class Config(object):
+
+    def __init__(self):
+        self.name = 'config'
+
+    @property
+    def settings(self):
+        return {}
+
+
+@benchmark
+def bench_attributes():
+    """
+    Cost of reading a property and an instance attribute through a wrapper
+    compared with reading them directly
+    """
+    number = 10 ** 5
+    direct = Config()
+    wrapped = Deride.wrap(Config())
+    return [
+        ('direct property', number, per_call(min(timeit.repeat(
+            lambda: direct.settings, number=number, repeat=3)), number)),
+        ('wrapped property', number, per_call(min(timeit.repeat(
+            lambda: wrapped.settings, number=number, repeat=3)), number)),
+        ('direct attribute', number, per_call(min(timeit.repeat(
+            lambda: direct.name, number=number, repeat=3)), number)),
+        ('wrapped attribute', number, per_call(min(timeit.repeat(
+            lambda: wrapped.name, number=number, repeat=3)), number)),
+    ]
+
+
+def bare(value):
+    """
+    The function called directly and spied on by bench_func
+    """
+    return value
+
+
+@benchmark
+def bench_func():
+    """
+    Cost of calling a function spy compared with a bare call
+    """
+    number = 10 ** 5
+    spy = Deride.func(bare, record='counts')
+    full = Deride.func(bare)
+    return [
+        ('bare call', number, per_call(min(timeit.repeat(
+            lambda: bare(1), number=number, repeat=3)), number)),
+        ('func call, counts', number, per_call(min(timeit.repeat(
+            lambda: spy(1), number=number, repeat=3)), number)),
+        ('func call, full', number, per_call(min(timeit.repeat(
+            lambda: full(1), number=number, repeat=3)), number)),
+    ]
+
+
+def report(results, target):
+    """
+    Writes the results as JSON, along with the platform they were measured
+    on, to the target path or to stdout for -
+    """
+    document = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if target == '-':
+        json.dump(document, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+    with open(target, 'w') as stream:
+        json.dump(document, stream, indent=2)
+
+
+def main(argv=None):
+    """
+    Runs every registered benchmark, or those named, and prints the results
+    """
+    parser = argparse.ArgumentParser(description='Benchmarks for Deride')
+    parser.add_argument('--json', metavar='PATH',
+                        help='also write the results as JSON, - for stdout')
+    parser.add_argument('names', nargs='*',
+                        help='only run the benchmarks with these names, '
+                             'e.g. bench_notify')
+    options = parser.parse_args(argv)
+
+    results = []
+    for func in BENCHMARKS:
+        if options.names and func.__name__ not in options.names:
+            continue
+        for name, number, micros in func():
+            results.append({'benchmark': func.__name__, 'name': name,
+                            'n': number, 'us_per_op': micros})
+            if options.json != '-':
+                print('{name:<30} n={number:<10} {micros:.3f}us/op'
+                      .format(name=name, number=number, micros=micros))
+    if options.json:
+        report(results, options.json)
+
+
+if __name__ == '__main__':
+    main()
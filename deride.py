@@ -4,20 +4,432 @@
 A mocking package with a fluent interface
 
 """
+import asyncio
+import json
+import math
+import os
+import re
+import sys
+import sysconfig
+import threading
+import weakref
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Mapping
+from copy import copy
+from inspect import isawaitable, iscoroutinefunction
+from itertools import count, cycle, islice
+from multiprocessing import util
+from multiprocessing.reduction import ForkingPickler
+from multiprocessing.connection import Client, Listener
+from numbers import Number
+from operator import itemgetter
+from pickle import PicklingError
+from time import perf_counter
+try:
+    from time import thread_time
+except ImportError:  # pragma: no cover
+    from time import process_time as thread_time
+from types import MethodType
+
 from cachetools import hashkey
 
+try:
+    from dataclasses import fields, is_dataclass
+except ImportError:  # pragma: no cover
+    fields = is_dataclass = None
+
+try:
+    from functools import cached_property
+except ImportError:  # pragma: no cover
+    cached_property = None
+
+
+ATOMIC_TYPES = frozenset([
+    type(None), bool, int, float, complex, str, bytes
+])
+
+PROPERTY_TYPES = (property, cached_property) if cached_property is not None \
+    else (property,)
+
+VALUE_TYPES = (tuple, Number, Mapping)
+
+VALUE_METHODS = ('__eq__', '__lt__', '__le__', '__gt__', '__ge__', '__add__',
+                 '__sub__', '__mul__', '__truediv__', '__floordiv__',
+                 '__mod__', '__pow__', '__neg__', '__and__', '__or__')
+
+STDLIB_PATH = os.path.realpath(sysconfig.get_paths()['stdlib'])
+
+
+class IdentityKey(object):
+    """
+    Key for an unhashable value with no registered conversion, it only
+    matches the very same object
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __hash__(self):
+        return id(self.value)
+
+    def __eq__(self, other):
+        return isinstance(other, IdentityKey) and other.value is self.value
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class KeyEngine(object):
+    """
+    Turns arguments into canonical hashable forms so that unhashable values
+    such as lists, dicts, sets and dataclasses can be used as keys.
+
+    Conversions are registered per type and are looked up through the
+    type's mro, values of other types are used as they are when hashable.
+    Within a single key each object is converted only once.
+    """
+
+    def __init__(self):
+        self.converters = {}
+        self.resolved = {}
+        self.register(list, self.sequence(list))
+        self.register(tuple, self.sequence(tuple))
+        self.register(dict, self.mapping)
+        self.register(set, self.collection)
+        self.register(frozenset, self.collection)
+
+    def register(self, kind, converter):
+        """
+        Registers a converter for values of the supplied type.  The
+        converter is called with the value and a function which converts
+        the nested values and must return a hashable object
+        """
+        self.converters[kind] = converter
+        self.resolved = {}
+
+    @staticmethod
+    def sequence(tag):
+        """
+        Returns a converter for ordered sequences
+        """
+        def convert(value, canonical):
+            """
+            Converts each item of the sequence in order
+            """
+            return tag, tuple(canonical(item) for item in value)
+        return convert
+
+    @staticmethod
+    def mapping(value, canonical):
+        """
+        Converts the items of a mapping regardless of their order
+        """
+        return dict, frozenset(
+            (canonical(key), canonical(item)) for key, item in value.items())
+
+    @staticmethod
+    def collection(value, canonical):
+        """
+        Converts the members of an unordered collection
+        """
+        return frozenset, frozenset(canonical(item) for item in value)
+
+    @staticmethod
+    def dataclass(value, canonical):
+        """
+        Converts the fields of a dataclass instance
+        """
+        return type(value), tuple(
+            (field.name, canonical(getattr(value, field.name)))
+            for field in fields(value))
+
+    def converter_for(self, kind):
+        """
+        Returns the converter registered for the type or one of its bases
+        """
+        try:
+            return self.resolved[kind]
+        except KeyError:
+            pass
+        converter = None
+        for base in kind.__mro__:
+            if base in self.converters:
+                converter = self.converters[base]
+                break
+        self.resolved[kind] = converter
+        return converter
+
+    def canonical(self, value, memo):
+        """
+        Returns the canonical hashable form of the value
+        """
+        kind = type(value)
+        if kind in ATOMIC_TYPES:
+            return value
+
+        ident = id(value)
+        try:
+            return memo[ident]
+        except KeyError:
+            pass
+        memo[ident] = IdentityKey(value)
+
+        def nested(item):
+            """
+            Converts a value nested inside the current one
+            """
+            return self.canonical(item, memo)
+
+        converter = self.converter_for(kind)
+        if converter is not None:
+            result = converter(value, nested)
+        else:
+            try:
+                hash(value)
+                result = value
+            except TypeError:
+                if is_dataclass is not None and is_dataclass(value):
+                    result = self.dataclass(value, nested)
+                else:
+                    result = memo[ident]
+        memo[ident] = result
+        return result
+
+    def key(self, *args, **kwds):
+        """
+        Returns the key for the supplied *args and **kwds
+        """
+        memo = {}
+        return hashkey(
+            *[self.canonical(arg, memo) for arg in args],
+            **dict((name, self.canonical(value, memo))
+                   for name, value in kwds.items()))
+
 
 class ObjectKey(object):
     """
-    Utility for generating a key from arguments and keyword arguments
+    Utility for generating a key from arguments and keyword arguments.
+
+    The conversion of the arguments is delegated to `engine` which can be
+    replaced or extended with KeyEngine.register
     """
 
+    engine = KeyEngine()
+
     @staticmethod
     def value(*args, **kwds):
         """
         returns the generated hashkey of the *args and **kwds
         """
-        return hashkey(*args, **kwds)
+        return ObjectKey.engine.key(*args, **kwds)
+
+
+class Matcher(object):
+    """
+    Base class of the argument matchers which can be used in place of an
+    argument with when() and with the call assertions.
+
+    Matchers which are more specific are tried first when more than one of
+    them could match the same argument.
+    """
+    specificity = 0
+
+    def matches(self, value):
+        """
+        Returns whether the value is matched
+        """
+        raise NotImplementedError()
+
+    def key(self):
+        """
+        Returns the key identifying the matcher when registered with when()
+        """
+        return self
+
+
+class Any(Matcher):
+    """
+    Matches any value or, when types are supplied, any instance of them
+    """
+
+    def __init__(self, *types):
+        self.types = types
+
+    def matches(self, value):
+        return not self.types or isinstance(value, self.types)
+
+    def __repr__(self):
+        return 'Any({types})'.format(
+            types=', '.join(kind.__name__ for kind in self.types))
+
+
+class Regex(Matcher):
+    """
+    Matches strings in which the regular expression pattern is found
+    """
+    specificity = 2
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = re.compile(pattern, flags)
+
+    def matches(self, value):
+        return isinstance(value, str) and \
+            self.pattern.search(value) is not None
+
+    def key(self):
+        return Regex, self.pattern.pattern, self.pattern.flags
+
+    def __repr__(self):
+        return 'Regex({pattern!r})'.format(pattern=self.pattern.pattern)
+
+
+class Predicate(Matcher):
+    """
+    Matches values for which the supplied function returns true
+    """
+    specificity = 1
+
+    def __init__(self, func):
+        self.func = func
+
+    def matches(self, value):
+        return bool(self.func(value))
+
+    def key(self):
+        return Predicate, self.func
+
+    def __repr__(self):
+        return 'Predicate({func!r})'.format(func=self.func)
+
+
+class Repr(Matcher):
+    """
+    Matches values of the named type whose repr is the supplied text, the
+    values which JSON cannot represent are replayed as Repr matchers
+    """
+    specificity = 1
+
+    def __init__(self, kind, text):
+        self.kind = kind
+        self.text = text
+
+    def matches(self, value):
+        return type(value).__name__ == self.kind and repr(value) == self.text
+
+    def key(self):
+        return Repr, self.kind, self.text
+
+    def __repr__(self):
+        return 'Repr({kind}, {text!r})'.format(kind=self.kind, text=self.text)
+
+
+class MatcherNode(object):
+    """
+    A node of a MatcherTree, branching on the value of a single argument
+    """
+    __slots__ = ('exact', 'types', 'unions', 'anything', 'matchers',
+                 'ordered', 'actions')
+
+    def __init__(self):
+        self.exact = {}
+        self.types = {}
+        self.unions = {}
+        self.anything = None
+        self.matchers = {}
+        self.ordered = []
+        self.actions = None
+
+    def child(self, value):
+        """
+        Returns the child node for the argument value or matcher, creating
+        it when needed
+        """
+        if not isinstance(value, Matcher):
+            key = ObjectKey.engine.canonical(value, {})
+            return self.exact.setdefault(key, MatcherNode())
+        if isinstance(value, Any) and not value.types:
+            if self.anything is None:
+                self.anything = MatcherNode()
+            return self.anything
+        if isinstance(value, Any):
+            kinds = frozenset(value.types)
+            if len(kinds) == 1:
+                return self.types.setdefault(value.types[0], MatcherNode())
+            if kinds not in self.unions:
+                self.unions[kinds] = (tuple(kinds), MatcherNode())
+            return self.unions[kinds][1]
+        key = value.key()
+        if key not in self.matchers:
+            self.matchers[key] = (value, MatcherNode())
+            self.ordered = sorted(self.matchers.values(),
+                                  key=lambda item: -item[0].specificity)
+        return self.matchers[key][1]
+
+    def candidates(self, value):
+        """
+        Iterates the child nodes matching the argument value, the most
+        specific first
+        """
+        if self.exact:
+            node = self.exact.get(ObjectKey.engine.canonical(value, {}))
+            if node is not None:
+                yield node
+        for matcher, node in self.ordered:
+            if matcher.matches(value):
+                yield node
+        if self.types:
+            for kind in type(value).__mro__:
+                node = self.types.get(kind)
+                if node is not None:
+                    yield node
+        for kinds, node in self.unions.values():
+            if isinstance(value, kinds):
+                yield node
+        if self.anything is not None:
+            yield self.anything
+
+
+class MatcherTree(object):
+    """
+    Decision tree of the argument patterns registered with when() for a
+    single shape of arguments.
+
+    Each level of the tree branches on one argument, trying literal values
+    first, then Regex and Predicate matchers, then Any(type), Any(types)
+    and lastly Any().  Literal values and single types are looked up by
+    hash so finding the actions does not try every registered pattern.
+    """
+
+    def __init__(self):
+        self.root = MatcherNode()
+
+    def add(self, values, actions):
+        """
+        Registers the actions for the sequence of values and matchers
+        """
+        node = self.root
+        for value in values:
+            node = node.child(value)
+        node.actions = actions
+        return actions
+
+    def find(self, values):
+        """
+        Returns the actions of the most specific pattern matching the
+        values, or None
+        """
+        return self.__find__(self.root, values, 0)
+
+    def __find__(self, node, values, depth):
+        if depth == len(values):
+            return node.actions
+        for child in node.candidates(values[depth]):
+            actions = self.__find__(child, values, depth + 1)
+            if actions is not None:
+                return actions
+        return None
 
 
 class Invocation(object):
@@ -25,388 +437,3006 @@ class Invocation(object):
     Models a single encapsulation of a function including the agurments
     used to invoke it
     """
+    __slots__ = ('name', 'args', 'kwargs', 'timestamp', 'duration',
+                 'cpu_duration', 'result', 'error')
 
     def __init__(self, name, *args, **kwargs):
         self.name = name
         self.args = args
         self.kwargs = kwargs
+        self.timestamp = None
+        self.duration = None
+        self.cpu_duration = None
+        self.result = None
+        self.error = None
 
-
-class CallAssertions(object):
+    def snapshot(self, capture):
+        """
+        Returns a copy of the invocation with capture applied to each of the
+        arguments
+        """
+        invocation = Invocation(
+            self.name, *[capture(arg) for arg in self.args],
+            **dict((name, capture(value))
+                   for name, value in self.kwargs.items()))
+        invocation.timestamp = self.timestamp
+        invocation.duration = self.duration
+        invocation.cpu_duration = self.cpu_duration
+        invocation.result = self.result
+        invocation.error = self.error
+        return invocation
+
+
+class Timing(object):
     """
-    A set of assertions to use against all invocations of a particular method
+    Streaming summary of the durations, in milliseconds, of the invocations
+    of a method.
+
+    Durations are counted in buckets which grow geometrically so that the
+    memory used stays constant however many invocations are recorded, the
+    percentiles are accurate to within `precision`.
     """
 
-    def __init__(self, invocations):
-        self.number = len(invocations)
-        self.invocations = invocations
+    def __init__(self, precision=0.01):
+        self.growth = math.log(1 + precision)
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.cpu_total = 0.0
+        self.min = None
+        self.max = None
 
-    def __times_error__(self, msg):
-        msg = '{msg}. times={calls}' \
-            .format(msg=msg, calls=self.number)
-        return AssertionError(msg)
+    def record(self, duration, cpu_duration=None):
+        """
+        Adds the duration of an invocation to the summary
+        """
+        if duration > 0:
+            bucket = int(math.floor(math.log(duration) / self.growth))
+        else:
+            bucket = None
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += duration
+        if cpu_duration is not None:
+            self.cpu_total += cpu_duration
+        if self.min is None or duration < self.min:
+            self.min = duration
+        if self.max is None or duration > self.max:
+            self.max = duration
+
+    def percentile(self, percent):
+        """
+        Returns the duration below which the supplied percentage of the
+        invocations fall, or None when nothing was recorded
+        """
+        if not self.count:
+            return None
+        rank = max(int(math.ceil(percent / 100.0 * self.count)), 1)
+        seen = self.buckets.get(None, 0)
+        if seen >= rank:
+            return 0.0
+        for bucket in sorted(key for key in self.buckets if key is not None):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                value = math.exp((bucket + 0.5) * self.growth)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def p50(self):
+        """
+        The median duration
+        """
+        return self.percentile(50)
 
-    def times(self, number):
+    @property
+    def p95(self):
         """
-        Asserts the actual number of times the invocation happened is equal
-        to the actual number
+        The 95th percentile duration
+        """
+        return self.percentile(95)
 
-        Raises an AssertionError when the actual number does not equal
-        the expected number
+    @property
+    def p99(self):
         """
-        if self.number != number:
-            raise self.__times_error__('times assertion error')
+        The 99th percentile duration
+        """
+        return self.percentile(99)
 
-    def once(self):
+    @property
+    def mean(self):
         """
-        Facade of times(n) with n being 1
+        The mean duration, or None when nothing was recorded
         """
-        self.times(1)
+        if not self.count:
+            return None
+        return self.total / self.count
 
-    def twice(self):
+
+def is_hashable(value):
+    """
+    Returns whether the value can be used as a key
+    """
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def has_matchers(args):
+    """
+    Returns whether any of the args is a Matcher
+    """
+    return any(isinstance(arg, Matcher) for arg in args)
+
+
+def has_identity_keys(key):
+    """
+    Returns whether any part of the key only matches the very same object,
+    such keys cannot find values which are merely equal
+    """
+    if isinstance(key, IdentityKey):
+        return True
+    if isinstance(key, (tuple, frozenset)):
+        return any(has_identity_keys(part) for part in key)
+    return False
+
+
+def is_stdlib(module):
+    """
+    Returns whether the named module is part of the standard library
+    """
+    top = module.partition('.')[0]
+    if top == '__main__':
+        return False
+    names = getattr(sys, 'stdlib_module_names', None)
+    if names is not None:
+        return top in names
+    loaded = sys.modules.get(top)
+    path = getattr(loaded, '__file__', None)
+    if path is None:
+        return loaded is not None
+    path = os.path.realpath(path)
+    return path.startswith(STDLIB_PATH) and 'site-packages' not in path
+
+
+def is_value_type(kind):
+    """
+    Returns whether instances of the type behave as values, they are
+    numbers, tuples or mappings or are compared or combined with operators
+    """
+    return issubclass(kind, VALUE_TYPES) or any(
+        name in vars(base) for base in kind.__mro__ if base is not object
+        for name in VALUE_METHODS)
+
+
+def is_literal(value):
+    """
+    Returns whether the value is hashable and not a Matcher, so that it can
+    be looked up in an index
+    """
+    return not isinstance(value, Matcher) and is_hashable(value)
+
+
+def weak_reference(value):
+    """
+    Returns a weak reference to the value, or the value itself when it
+    cannot be referenced weakly
+    """
+    try:
+        return weakref.ref(value)
+    except TypeError:
+        return value
+
+
+def matches_arg(expected, actual):
+    """
+    Returns whether the actual arg is matched by, or equal to, the expected
+    """
+    if isinstance(expected, Matcher):
+        if type(actual) is weakref.ref:
+            actual = actual()
+        return expected.matches(actual)
+    return expected == actual
+
+
+def contains_args(actual, expected):
+    """
+    Returns whether every expected arg matches one of the actual args
+    """
+    return all(any(matches_arg(arg, item) for item in actual)
+               for arg in expected)
+
+
+def matches_args(actual, expected):
+    """
+    Returns whether the actual args match the expected args in order
+    """
+    return len(actual) == len(expected) and \
+        all(matches_arg(arg, item) for arg, item in zip(expected, actual))
+
+
+class RecordingError(Exception):
+    """
+    Raised when an assertion needs invocations which were not recorded
+    """
+
+
+class ArgumentIndex(object):
+    """
+    Index of the arguments of the invocations of a single method.
+
+    The index is brought up to date from the invocation log only when it is
+    queried, positions of the invocations are kept per hashable argument and
+    per tuple of arguments.  Invocations with unhashable arguments are
+    compared by equality.
+    """
+
+    def __init__(self, log):
+        self.log = log
+        self.indexed = log.first
+        self.args = {}
+        self.strict = {}
+        self.unhashable_strict = []
+
+    def update(self):
         """
-        Facade of times(n) with n being 2
+        Indexes the invocations recorded since the last update
         """
-        self.times(2)
+        log = self.log
+        recorded = log.count
+        for position in range(self.indexed, recorded):
+            args = log.at(position).args
+            try:
+                self.strict.setdefault(args, []).append(position)
+            except TypeError:
+                self.unhashable_strict.append(position)
+            for arg in args:
+                try:
+                    positions = self.args.setdefault(arg, [])
+                except TypeError:
+                    continue
+                if not positions or positions[-1] != position:
+                    positions.append(position)
+        self.indexed = recorded
 
-    def lt(self, number):
+    @staticmethod
+    def within(positions, start, stop):
         """
-        Asserts the actual number of times the invocation happened is less
-        than the expected number
+        Iterates the sorted positions from start up to but excluding stop
+        """
+        for found in range(bisect_left(positions, start), len(positions)):
+            position = positions[found]
+            if position >= stop:
+                return
+            yield position
 
-        Raises an AssertionError when the actual number is greater than
-        or equal to the expected number
+    @staticmethod
+    def contains(positions, position):
         """
-        if self.number >= number:
-            raise self.__times_error__('lt assertion error')
+        Returns whether the sorted positions contain the position
+        """
+        found = bisect_left(positions, position)
+        return found < len(positions) and positions[found] == position
 
-    def lte(self, number):
+    def find(self, expected, start, stop):
         """
-        Asserts the actual number of times the invocation happened is less
-        than or equal to the expected number
+        Returns whether an invocation between start and stop contains all of
+        the expected args in any order
+        """
+        self.update()
+        hashable = [arg for arg in expected if is_literal(arg)]
+        unhashable = [arg for arg in expected if not is_literal(arg)]
+
+        if hashable:
+            found = []
+            for arg in hashable:
+                positions = self.args.get(arg)
+                if not positions:
+                    return False
+                found.append(positions)
+            found.sort(key=len)
+            candidates = (position
+                          for position in self.within(found[0], start, stop)
+                          if all(self.contains(other, position)
+                                 for other in found[1:]))
+        else:
+            candidates = range(start, stop)
+
+        return any(contains_args(self.log.at(position).args, unhashable)
+                   for position in candidates)
+
+    def find_strict(self, expected, start, stop):
+        """
+        Returns whether an invocation between start and stop has exactly the
+        expected args in order
+        """
+        self.update()
+        if not expected:
+            return stop > start
+        if is_hashable(expected) and not has_matchers(expected):
+            for _ in self.within(self.strict.get(expected, ()), start, stop):
+                return True
+            candidates = self.within(self.unhashable_strict, start, stop)
+        else:
+            candidates = range(start, stop)
+        return any(matches_args(self.log.at(position).args, expected)
+                   for position in candidates)
+
+
+class InvocationLog(object):
+    """
+    Append only log of every invocation of a single method.
 
-        Raises an AssertionError when the actual number is greater than
-        to the expected number
+    Invocations are addressed by their absolute position, the first
+    invocation ever recorded for the method is at position 0.  Positions
+    keep growing when the log is reset or trimmed, `origin` is the position
+    of the first invocation since the last reset.
+
+    The invocations of a method of a source of a Timeline are also held by
+    the timeline, `source` is then the timeline, the reference of the source
+    and the name of the method so that its entries are released with the
+    invocations of the log when it is reset.
+    """
+    keeps = True
+
+    def __init__(self):
+        self.invocations = []
+        self.dropped = 0
+        self.origin = 0
+        self.index = None
+        self.summary = None
+        self.timing = None
+        self.source = None
+
+    @classmethod
+    def of(cls, invocations, summary=None):
         """
-        if self.number > number:
-            raise self.__times_error__('lte assertion error')
+        Returns a log containing the supplied invocations, with the timing
+        of those whose duration was recorded
+        """
+        log = cls()
+        log.summary = summary
+        for invocation in invocations:
+            log.append(invocation)
+            if invocation.duration is not None:
+                if log.timing is None:
+                    log.timing = Timing()
+                log.timing.record(invocation.duration,
+                                  invocation.cpu_duration)
+        return log
+
+    def summarise(self, args):
+        """
+        Applies the summary the invocations were recorded with to a set of
+        expected args so that they can be compared with the recorded ones
+        """
+        if self.summary is None:
+            return args
+        return tuple(arg if isinstance(arg, Matcher) else self.summary(arg)
+                     for arg in args)
 
-    def gt(self, number):
+    @property
+    def count(self):
         """
-        Asserts the actual number of times the invocation happened is greater
-        than the expected number
+        The number of invocations ever recorded
+        """
+        return self.dropped + len(self.invocations)
 
-        Raises an AssertionError when the actual number is less than
-        or equal to the expected number
+    @property
+    def first(self):
         """
-        if self.number <= number:
-            raise self.__times_error__('gt assertion error')
+        The position of the oldest invocation still held by the log
+        """
+        return self.count - len(self.invocations)
 
-    def gte(self, number):
+    def append(self, invocation):
         """
-        Asserts the actual number of times the invocation happened is greater
-        than or equal to the expected number
+        Records the next invocation
+        """
+        self.invocations.append(invocation)
 
-        Raises an AssertionError when the actual number is less than
-        the expected number
+    def at(self, position):
         """
-        if self.number < number:
+        Returns the invocation at the absolute position
+        """
+        if position < self.first:
+            raise RecordingError(
+                'invocation {position} is no longer recorded, only the last '
+                '{kept} invocations are kept'
+                .format(position=position, kept=len(self.invocations)))
+        return self.invocations[position - self.first]
+
+    def between(self, start, stop):
+        """
+        Iterates the invocations from start up to but excluding stop
+        """
+        first = self.first
+        return islice(self.invocations,
+                      max(start - first, 0), max(stop - first, 0))
+
+    def trim(self, position):
+        """
+        Discards the invocations held before the absolute position
+        """
+        drop = min(position, self.count) - self.first
+        if drop > 0:
+            del self.invocations[:drop]
+            self.dropped += drop
+            self.index = None
+
+    def reset(self):
+        """
+        Discards every invocation held, only the invocations recorded from
+        now on are counted
+        """
+        self.trim(self.count)
+        self.origin = self.count
+        self.timing = None
+        if self.source is not None:
+            timeline, ref, name = self.source
+            timeline.release(ref, name=name)
+
+    def argument_index(self):
+        """
+        Returns the argument index of the log, or None when the log keeps
+        too few invocations to be worth indexing
+        """
+        if self.index is None:
+            self.index = ArgumentIndex(self)
+        return self.index
+
+
+class LastInvocationsLog(InvocationLog):
+    """
+    Log which counts every invocation but only keeps the last `limit`
+    """
+
+    def __init__(self, limit):
+        super(LastInvocationsLog, self).__init__()
+        self.invocations = deque(maxlen=limit)
+        self.total = 0
+
+    @property
+    def count(self):
+        return self.total
+
+    def append(self, invocation):
+        self.total += 1
+        self.invocations.append(invocation)
+
+    def trim(self, position):
+        for _ in range(min(position, self.count) - self.first):
+            self.invocations.popleft()
+
+    def argument_index(self):
+        return None
+
+
+class CountingLog(InvocationLog):
+    """
+    Log which only counts the invocations without keeping any of them
+    """
+    keeps = False
+
+    def __init__(self):
+        super(CountingLog, self).__init__()
+        self.total = 0
+
+    @property
+    def count(self):
+        return self.total
+
+    def append(self, invocation):
+        self.total += 1
+
+    @staticmethod
+    def __unrecorded__():
+        return RecordingError(
+            'invocations are only counted, record="full" or '
+            'record="last_n" is needed to assert on them')
+
+    def at(self, position):
+        raise self.__unrecorded__()
+
+    def between(self, start, stop):
+        raise self.__unrecorded__()
+
+    def trim(self, position):
+        pass
+
+    def argument_index(self):
+        return None
+
+
+class CallAssertions(object):
+    """
+    A set of assertions to use against all invocations of a particular method
+    """
+
+    def __init__(self, log, start=None, stop=None):
+        if start is None:
+            start = log.origin
+        if stop is None:
+            stop = log.count
+        self.log = log
+        self.start = start
+        self.stop = stop
+        self.number = stop - start
+
+    @property
+    def invocations(self):
+        """
+        The recorded invocations covered by these assertions
+        """
+        return list(self.__recorded__())
+
+    def __recorded__(self):
+        """
+        Iterates the invocations which had been recorded when these
+        assertions were created
+        """
+        return self.log.between(self.start, self.stop)
+
+    def reset(self):
+        """
+        Discards the invocations of the method recorded so far, assertions
+        made from now on only see the later invocations
+        """
+        self.log.reset()
+
+    def __times_error__(self, msg):
+        msg = '{msg}. times={calls}' \
+            .format(msg=msg, calls=self.number)
+        return AssertionError(msg)
+
+    def times(self, number):
+        """
+        Asserts the actual number of times the invocation happened is equal
+        to the actual number
+
+        Raises an AssertionError when the actual number does not equal
+        the expected number
+        """
+        if self.number != number:
+            raise self.__times_error__('times assertion error')
+
+    def once(self):
+        """
+        Facade of times(n) with n being 1
+        """
+        self.times(1)
+
+    def twice(self):
+        """
+        Facade of times(n) with n being 2
+        """
+        self.times(2)
+
+    def lt(self, number):
+        """
+        Asserts the actual number of times the invocation happened is less
+        than the expected number
+
+        Raises an AssertionError when the actual number is greater than
+        or equal to the expected number
+        """
+        if self.number >= number:
+            raise self.__times_error__('lt assertion error')
+
+    def lte(self, number):
+        """
+        Asserts the actual number of times the invocation happened is less
+        than or equal to the expected number
+
+        Raises an AssertionError when the actual number is greater than
+        to the expected number
+        """
+        if self.number > number:
+            raise self.__times_error__('lte assertion error')
+
+    def gt(self, number):
+        """
+        Asserts the actual number of times the invocation happened is greater
+        than the expected number
+
+        Raises an AssertionError when the actual number is less than
+        or equal to the expected number
+        """
+        if self.number <= number:
+            raise self.__times_error__('gt assertion error')
+
+    def gte(self, number):
+        """
+        Asserts the actual number of times the invocation happened is greater
+        than or equal to the expected number
+
+        Raises an AssertionError when the actual number is less than
+        the expected number
+        """
+        if self.number < number:
             raise self.__times_error__('gte assertion error')
 
     def never(self):
         """
-        Facade of times(n) with n being 0
+        Facade of times(n) with n being 0
+        """
+        self.times(0)
+
+    def faster_than(self, milliseconds, percentile=None):
+        """
+        Asserts that every invocation, or the supplied percentile of the
+        invocations, took less than the expected number of milliseconds
+
+        Raises an AssertionError when the actual duration is greater than
+        or equal to the expected one
+        """
+        if not self.number:
+            return
+        timing = self.__timing__()
+        if percentile is None:
+            actual = timing.max
+        else:
+            actual = timing.percentile(percentile)
+        if actual >= milliseconds:
+            raise AssertionError(
+                'faster_than assertion error. duration={actual}ms'
+                .format(actual=actual))
+
+    def __timing__(self):
+        """
+        Returns the Timing of the invocations covered by these assertions,
+        summarised afresh from their durations when they are only a window
+        of the log
+        """
+        log = self.log
+        if log.timing is None:
+            raise RecordingError(
+                'durations are not recorded, wrap with timing=True to '
+                'assert on them')
+        if self.start == log.origin and self.stop == log.count:
+            return log.timing
+        if self.start < log.first:
+            raise RecordingError(
+                'durations of the invocations from {start} are no longer '
+                'recorded, only the last {kept} invocations are kept'
+                .format(start=self.start, kept=len(log.invocations)))
+        return InvocationLog.of(self.__recorded__()).timing or Timing()
+
+    def with_arg(self, arg):
+        """
+        Facade of with_args(arg) supplying only a single arg which is the
+        expected
+        """
+        self.with_args(arg)
+
+    def with_args(self, *args):
+        """
+        Asserts that an invocation exists which contains the expected args in
+        any order
+
+        Raises an AssertionError if one or more of the expected args does not
+        exist in the actual args of the invocations
+        """
+        # args stays referenced until the search is over as the summary of
+        # an expected arg may only reference it weakly
+        summarised = self.log.summarise(args)
+        index = self.log.argument_index()
+        if index is not None:
+            found = index.find(summarised, self.start, self.stop)
+        else:
+            found = any(contains_args(invocation.args, summarised)
+                        for invocation in self.__recorded__())
+        if not found:
+            raise AssertionError('invocation matching arguments not found')
+
+    def with_match(self, *patterns):
+        """
+        Facade of with_args(*patterns) where each pattern is a Matcher or a
+        regular expression which an arg of the invocation must match
+        """
+        self.with_args(*[pattern if isinstance(pattern, Matcher)
+                         else Regex(pattern) for pattern in patterns])
+
+    def with_args_strict(self, *args):
+        """
+        Asserts that an invocation exists which contains the expected args in
+        order defined in the expected args
+
+        Raises an AssertionError if one or more of the expected args does not
+        exist in the actual args of the invocations or if the args exist but
+        not in the expected order
+        """
+        summarised = self.log.summarise(args)
+        index = self.log.argument_index()
+        if index is not None:
+            found = index.find_strict(summarised, self.start, self.stop)
+        else:
+            found = any(not summarised or
+                        matches_args(invocation.args, summarised)
+                        for invocation in self.__recorded__())
+        if not found:
+            raise AssertionError('invocation matching arguments not found')
+
+    def __expected__(self, expected):
+        """
+        Returns each of the expected calls as a tuple of summarised args, a
+        value which is not a tuple is the single arg of a call
+        """
+        return [self.log.summarise(args if isinstance(args, tuple)
+                                   else (args,))
+                for args in expected]
+
+    @staticmethod
+    def __missing_error__(msg, missing):
+        return AssertionError('{msg}. missing={missing}'
+                              .format(msg=msg, missing=missing))
+
+    def with_all(self, expected):
+        """
+        Asserts that for every expected tuple of args an invocation exists
+        with exactly those args in order, as with_args_strict.  A value which
+        is not a tuple is the single arg of an expected invocation
+
+        Raises an AssertionError listing every expected call which does not
+        exist in the invocations
+        """
+        # expected stays referenced as in with_args
+        summarised = self.__expected__(expected)
+        found = set()
+        wanted = {}
+        patterns = {}
+        index = self.log.argument_index()
+        for position, args in enumerate(summarised):
+            if has_matchers(args):
+                patterns[position] = args
+            elif index is not None and is_hashable(args):
+                if index.find_strict(args, self.start, self.stop):
+                    found.add(position)
+            else:
+                key = ObjectKey.value(*args)
+                if has_identity_keys(key):
+                    patterns[position] = args
+                else:
+                    wanted.setdefault(key, []).append(position)
+
+        if wanted or patterns:
+            for invocation in self.__recorded__():
+                if wanted:
+                    found.update(
+                        wanted.pop(ObjectKey.value(*invocation.args), ()))
+                for position, args in list(patterns.items()):
+                    if matches_args(invocation.args, args):
+                        found.add(position)
+                        del patterns[position]
+                if not wanted and not patterns:
+                    break
+
+        missing = [args for position, args in enumerate(summarised)
+                   if position not in found]
+        if missing:
+            raise self.__missing_error__('with_all assertion error', missing)
+
+    def with_sequence(self, expected):
+        """
+        Asserts that invocations exist with exactly each expected tuple of
+        args, in the expected order although not necessarily one straight
+        after the other.  A value which is not a tuple is the single arg of
+        an expected invocation
+
+        Raises an AssertionError listing the expected calls from the first
+        one which could not be found in order
+        """
+        summarised = self.__expected__(expected)
+        matched = 0
+        if summarised:
+            for invocation in self.__recorded__():
+                if matches_args(invocation.args, summarised[matched]):
+                    matched += 1
+                    if matched == len(summarised):
+                        return
+        if matched < len(summarised):
+            raise self.__missing_error__('with_sequence assertion error',
+                                         summarised[matched:])
+
+
+class CallStats(object):
+    """
+    Container for the assertions of the invocations of a method.
+
+    The log is shared with the recording Expectations, only the invocations
+    recorded between start and stop are visible so that the view does not
+    change as further invocations are recorded.
+
+    The reads of an attribute are recorded as calls without args, its
+    writes in the separate `writes` log with the value written as the arg.
+    """
+
+    def __init__(self, log, start=None, stop=None, writes=None,
+                 writes_start=None):
+        if start is None:
+            start = log.origin
+        if stop is None:
+            stop = log.count
+        self.log = log
+        self.start = start
+        self.stop = stop
+        self.number = stop - start
+        self.called = CallAssertions(log, start, stop)
+        self.writes = writes
+        self.writes_start = writes_start
+
+    @property
+    def read(self):
+        """
+        The assertions of the reads of an attribute, the same as called
+        """
+        return self.called
+
+    @property
+    def written(self):
+        """
+        The assertions of the writes of an attribute
+        """
+        if self.writes is None:
+            return CallAssertions(InvocationLog())
+        return CallAssertions(self.writes, self.writes_start)
+
+    @property
+    def invocations(self):
+        """
+        The recorded invocations covered by these stats
+        """
+        return self.called.invocations
+
+    def reset(self):
+        """
+        Discards the invocations and timing of the method recorded so far
+        """
+        self.log.reset()
+
+    @property
+    def timing(self):
+        """
+        The Timing of every invocation recorded for the method, only
+        available when wrapped with timing=True
+        """
+        if self.log.timing is None:
+            return Timing()
+        return self.log.timing
+
+    def invocation(self, index):
+        """
+        Returns the specific invocation for the supplied index including
+        all of the expectation functions attached e.g. with_arg,
+        with_args etc...
+        """
+        if index < 0:
+            index += self.number
+        if not 0 <= index < self.number:
+            raise IndexError('invocation index out of range')
+        return CallAssertions(
+            InvocationLog.of([self.log.at(self.start + index)],
+                             self.log.summary))
+
+
+class InvocationSink(object):
+    """
+    Streams invocations to a file as they are recorded, one encoded
+    invocation per line, JSON lines by default.
+
+    The target is a path, which the sink opens and closes, or an open text
+    file.  Lines are buffered and written `buffer_size` at a time.
+    """
+
+    def __init__(self, target, encode=None, buffer_size=1000):
+        if isinstance(target, str):
+            self.stream = open(target, 'w')
+            self.owned = True
+        else:
+            self.stream = target
+            self.owned = False
+        self.encode = self.to_json if encode is None else encode
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.__lock__ = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    TAGS = frozenset(['__tuple__', '__set__', '__frozenset__', '__dict__',
+                      '__repr__', '__type__'])
+
+    @classmethod
+    def to_json(cls, invocation):
+        """
+        Encodes an invocation as a line of JSON, see tag for the values
+        which JSON does not support
+        """
+        error = invocation.error
+        return json.dumps({
+            'name': invocation.name,
+            'args': [cls.tag(arg) for arg in invocation.args],
+            'kwargs': dict((name, cls.tag(value))
+                           for name, value in invocation.kwargs.items()),
+            'result': cls.tag(invocation.result),
+            'error': None if error is None else repr(error),
+            'timestamp': invocation.timestamp,
+            'duration': invocation.duration,
+        })
+
+    @classmethod
+    def from_json(cls, line):
+        """
+        Decodes a line written by to_json, the arguments which JSON could
+        not represent become Repr matchers and such a result its repr
+        """
+        record = json.loads(line)
+        record['args'] = [cls.untag(arg, True) for arg in record['args']]
+        record['kwargs'] = dict((name, cls.untag(value, True))
+                                for name, value in record['kwargs'].items())
+        record['result'] = cls.untag(record['result'], False)
+        return record
+
+    @classmethod
+    def tag(cls, value):
+        """
+        Returns the value in a form JSON can represent which decodes to an
+        equal value.  Tuples, sets and dicts whose keys are not strings are
+        tagged with their type, any other value which JSON does not support
+        is written as its repr and the name of its type, as is a container
+        holding one
+        """
+        kind = type(value)
+        if value is None or kind in (bool, int, float, str):
+            return value
+        tagged = None
+        if kind in (list, tuple, set, frozenset):
+            items = [cls.tag(item) for item in value]
+            if not any(cls.__is_repr__(item) for item in items):
+                tagged = items if kind is list \
+                    else {'__{kind}__'.format(kind=kind.__name__): items}
+        elif kind is dict:
+            items = [(cls.tag(key), cls.tag(item))
+                     for key, item in value.items()]
+            if not any(cls.__is_repr__(key) or cls.__is_repr__(item)
+                       for key, item in items):
+                if all(isinstance(key, str) and key not in cls.TAGS
+                       for key, _ in items):
+                    tagged = dict(items)
+                else:
+                    tagged = {'__dict__': [list(item) for item in items]}
+        if tagged is None:
+            return {'__repr__': repr(value), '__type__': kind.__name__}
+        return tagged
+
+    @staticmethod
+    def __is_repr__(tagged):
+        """
+        Returns whether a tagged value was written as its repr
+        """
+        return isinstance(tagged, dict) and '__repr__' in tagged
+
+    @classmethod
+    def untag(cls, value, matchers):
+        """
+        Returns the value a tagged value was written for, a value written
+        as its repr becomes a Repr matcher or, without `matchers`, the repr
+        """
+        if isinstance(value, list):
+            return [cls.untag(item, matchers) for item in value]
+        if not isinstance(value, dict):
+            return value
+        if '__repr__' in value:
+            if matchers:
+                return Repr(value['__type__'], value['__repr__'])
+            return value['__repr__']
+        if '__tuple__' in value:
+            return tuple(cls.untag(item, matchers)
+                         for item in value['__tuple__'])
+        if '__set__' in value:
+            return set(cls.untag(item, matchers) for item in value['__set__'])
+        if '__frozenset__' in value:
+            return frozenset(cls.untag(item, matchers)
+                             for item in value['__frozenset__'])
+        if '__dict__' in value:
+            return dict((cls.untag(key, matchers), cls.untag(item, matchers))
+                        for key, item in value['__dict__'])
+        return dict((key, cls.untag(item, matchers))
+                    for key, item in value.items())
+
+    def write(self, invocation):
+        """
+        Buffers the encoded invocation, writing out the buffer once full
+        """
+        line = self.encode(invocation)
+        with self.__lock__:
+            self.buffer.append(line)
+            if len(self.buffer) >= self.buffer_size:
+                self.__write_buffer__()
+
+    def __write_buffer__(self):
+        if self.buffer:
+            self.stream.write('\n'.join(self.buffer) + '\n')
+            self.buffer = []
+
+    def flush(self):
+        """
+        Writes out every buffered invocation
+        """
+        with self.__lock__:
+            self.__write_buffer__()
+        self.stream.flush()
+
+    def close(self):
+        """
+        Flushes the sink, closing the file when the sink opened it
+        """
+        self.flush()
+        if self.owned:
+            self.stream.close()
+
+
+class Expectations(object):
+    """
+    Container for the expectations for the call assertions.
+
+    Invocations are appended to a per method log as they happen, the call
+    stats are only built when a method is read from the expectations.  The
+    record mode decides how much of each log is kept:
+
+    - 'full' keeps every invocation
+    - 'last_n' keeps the last `last_n` invocations
+    - 'counts' only counts the invocations
+
+    The snapshot decides what is kept of the arguments of each invocation:
+
+    - 'reference' (the default) keeps the arguments themselves
+    - 'copy' keeps a shallow copy of each argument
+    - 'weak' keeps a weak reference to each argument which can be referenced
+      weakly, so that recording does not keep the arguments alive
+    - a function keeps whatever it returns for each argument, expected
+      args are passed through the same function before being compared
+
+    Each invocation is also written to the sink, an InvocationSink, when
+    one is supplied.  The entries of the source in `__timeline__`, a
+    Timeline and the reference of the source when it has one, are released
+    along with its invocations when reset or trimmed.
+    """
+
+    def __init__(self, record='full', last_n=100, snapshot='reference',
+                 sink=None):
+        self.__sink__ = sink
+        self.__keeps__ = record == 'full'
+        self.__timeline__ = None
+        if record == 'full':
+            self.__log_type__ = InvocationLog
+        elif record == 'last_n':
+            self.__log_type__ = lambda: LastInvocationsLog(last_n)
+        elif record == 'counts':
+            self.__log_type__ = CountingLog
+        else:
+            raise ValueError('unknown record mode {record}, expected one of '
+                             'full, last_n or counts'.format(record=record))
+
+        self.__summary__ = None
+        if snapshot is None or snapshot == 'reference':
+            self.__capture__ = None
+        elif snapshot == 'copy':
+            self.__capture__ = copy
+        elif snapshot == 'weak':
+            self.__capture__ = self.__summary__ = weak_reference
+        elif callable(snapshot):
+            self.__capture__ = self.__summary__ = snapshot
+        else:
+            raise ValueError('unknown snapshot {snapshot}, expected '
+                             'reference, copy, weak or a function'
+                             .format(snapshot=snapshot))
+        self.data = {}
+
+    @staticmethod
+    def create(record='full', last_n=100, snapshot='reference',
+               threadsafe=False, sink=None, processes=False):
+        """
+        Returns the Expectations, thread safe or not, for the options
+        """
+        if processes:
+            return CollectedExpectations(record, last_n, snapshot, sink)
+        if threadsafe:
+            return ThreadSafeExpectations(record, last_n, snapshot, sink)
+        return Expectations(record, last_n, snapshot, sink)
+
+    def __new_log__(self, name=None):
+        """
+        Returns a new, empty, log for the invocations of the named method
+        """
+        log = self.__log_type__()
+        log.summary = self.__summary__
+        if name is not None and self.__keeps__ and \
+                self.__timeline__ is not None:
+            log.source = self.__timeline__ + (name,)
+        return log
+
+    def __getattr__(self, name):
+        try:
+            log = self.data[name]
+        except KeyError:
+            log = self.__new_log__()
+        return CallStats(log, writes=self.data.get(Wrapper.__setter__(name)))
+
+    def reset(self):
+        """
+        Removes all existing statistics of any methods being tracked
+        """
+        for log in self.data.values():
+            log.reset()
+        if self.__timeline__ is not None:
+            timeline, ref = self.__timeline__
+            timeline.release(ref)
+
+    def logs(self):
+        """
+        Returns the invocation logs of the methods tracked
+        """
+        return list(self.data.values())
+
+    def checkpoint(self):
+        """
+        Returns a mark of the invocations recorded so far, since(mark) only
+        sees the invocations recorded after it and trim(mark) discards those
+        recorded before it
+        """
+        mark = dict((name, log.count) for name, log in self.data.items())
+        if self.__timeline__ is not None:
+            mark[None] = self.__timeline__[0].count
+        return mark
+
+    def since(self, mark):
+        """
+        Returns the expectations of the invocations recorded after the mark
+        """
+        return ExpectationsWindow(self, mark)
+
+    def trim(self, mark):
+        """
+        Discards the invocations recorded before the mark so that a long
+        running wrapper can be asserted on in windows without holding every
+        invocation
+        """
+        for name, position in mark.items():
+            if name is not None:
+                self.data[name].trim(position)
+            elif self.__timeline__ is not None:
+                timeline, ref = self.__timeline__
+                timeline.release(ref, position)
+
+    def notify(self, invocation):
+        """
+        Records the next invocation against the log of its method, the
+        invocation recorded, a snapshot of it unless the arguments are kept
+        by reference, is returned
+        """
+        if self.__sink__ is not None:
+            self.__sink__.write(invocation)
+        if self.__capture__ is not None:
+            invocation = invocation.snapshot(self.__capture__)
+        self.__record__(invocation)
+        return invocation
+
+    def __record__(self, invocation):
+        """
+        Appends the invocation to the log of its method
+        """
+        try:
+            log = self.data[invocation.name]
+        except KeyError:
+            log = self.data.setdefault(invocation.name,
+                                       self.__new_log__(invocation.name))
+        log.append(invocation)
+        if invocation.duration is not None:
+            if log.timing is None:
+                log.timing = Timing()
+            log.timing.record(invocation.duration, invocation.cpu_duration)
+
+
+class ThreadSafeExpectations(Expectations):
+    """
+    Expectations which can be notified from many threads at once.
+
+    Each thread records into a buffer of its own without taking a lock, the
+    buffers are merged into the method logs, in the order the invocations
+    were made, whenever the expectations are read.
+    """
+
+    def __init__(self, *args, **kwds):
+        super(ThreadSafeExpectations, self).__init__(*args, **kwds)
+        self.__local__ = threading.local()
+        self.__buffers__ = []
+        self.__lock__ = threading.Lock()
+        self.__tickets__ = count()
+
+    def __getattr__(self, name):
+        self.__merge__()
+        return super(ThreadSafeExpectations, self).__getattr__(name)
+
+    def __merge__(self):
+        """
+        Moves the invocations buffered by every thread into the method logs,
+        the buffer of a thread is only dropped once the thread had exited
+        before it was drained
+        """
+        with self.__lock__:
+            pending = []
+            buffers = []
+            for thread, buffer in self.__buffers__:
+                alive = thread.is_alive()
+                drained = len(buffer)
+                pending.extend(buffer[:drained])
+                del buffer[:drained]
+                if alive or buffer:
+                    buffers.append((thread, buffer))
+            self.__buffers__ = buffers
+            pending.sort(key=itemgetter(0))
+            for _, invocation in pending:
+                self.__record__(invocation)
+
+    def logs(self):
+        self.__merge__()
+        return super(ThreadSafeExpectations, self).logs()
+
+    def checkpoint(self):
+        self.__merge__()
+        return super(ThreadSafeExpectations, self).checkpoint()
+
+    def reset(self):
+        """
+        Removes all existing statistics, including the buffered invocations
+        """
+        with self.__lock__:
+            for _, buffer in self.__buffers__:
+                del buffer[:]
+            super(ThreadSafeExpectations, self).reset()
+
+    def notify(self, invocation):
+        """
+        Buffers the next invocation for the current thread
+        """
+        if self.__sink__ is not None:
+            self.__sink__.write(invocation)
+        if self.__capture__ is not None:
+            invocation = invocation.snapshot(self.__capture__)
+        try:
+            buffer = self.__local__.buffer
+        except AttributeError:
+            buffer = self.__local__.buffer = []
+            with self.__lock__:
+                self.__buffers__.append((threading.current_thread(), buffer))
+        buffer.append((next(self.__tickets__), invocation))
+        return invocation
+
+
+class InvocationCollector(object):
+    """
+    Receives the invocations recorded by the copies of a wrapper which were
+    pickled to other processes.
+
+    The copies connect to a local listener, authenticated with a random
+    key, and send their invocations in batches.  A thread accepts the
+    connections and acknowledges them once they are drained, the batches
+    themselves are received when drained.  Once the collector is released
+    the thread is stopped by setting its stop event and connecting to the
+    listener so that the pending accept returns
+    """
+
+    def __init__(self):
+        self.authkey = os.urandom(16)
+        self.listener = Listener(authkey=self.authkey)
+        self.address = self.listener.address
+        self.connections = []
+        self.lock = threading.Lock()
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self.__accept__,
+            args=(self.listener, self.connections, self.lock, stop))
+        thread.daemon = True
+        thread.start()
+        weakref.finalize(self, self.__stop__, self.listener, self.authkey,
+                         stop, thread)
+
+    @staticmethod
+    def __accept__(listener, connections, lock, stop):
+        """
+        Accepts the connections of the copies until stopped
+        """
+        while True:
+            try:
+                connection = listener.accept()
+            except OSError:
+                return
+            except Exception:  # pylint: disable=broad-except
+                continue
+            if stop.is_set():
+                connection.close()
+                listener.close()
+                return
+            with lock:
+                connections.append(connection)
+            connection.send(True)
+
+    @staticmethod
+    def __stop__(listener, authkey, stop, thread):
+        """
+        Stops the thread accepting the connections and closes the listener
+        """
+        stop.set()
+        if thread.is_alive() and thread is not threading.current_thread():
+            try:
+                Client(listener.address, authkey=authkey).close()
+            except OSError:
+                pass
+            thread.join()
+        listener.close()
+
+    def drain(self, notify):
+        """
+        Passes each invocation received so far to notify
+        """
+        with self.lock:
+            connections = []
+            for connection in self.connections:
+                try:
+                    while connection.poll():
+                        for record in connection.recv():
+                            notify(RemoteExpectations.invocation(record))
+                    connections.append(connection)
+                except EOFError:
+                    connection.close()
+            self.connections[:] = connections
+
+
+class CollectedExpectations(ThreadSafeExpectations):
+    """
+    Expectations of a wrapper which can be pickled to other processes, the
+    invocations made by the copies are recorded along with those made in
+    this process whenever the expectations are read
+    """
+
+    def __init__(self, *args, **kwds):
+        super(CollectedExpectations, self).__init__(*args, **kwds)
+        self.collector = InvocationCollector()
+
+    def __merge__(self):
+        self.collector.drain(self.notify)
+        super(CollectedExpectations, self).__merge__()
+
+
+class InvocationBatch(object):
+    """
+    The invocations recorded by the copy of a wrapper which are still to be
+    sent to the collector.
+
+    The batch is held apart from the RemoteExpectations so that neither the
+    timer sending an idle batch nor the finalizer sending the last one on
+    exit keeps the expectations alive.  The timer is started by the first
+    invocation of a batch and cancelled once it is sent.
+    """
+
+    def __init__(self, connection, sending, flush_interval):
+        self.connection = connection
+        self.sending = sending
+        self.flush_interval = flush_interval
+        self.records = []
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def append(self, record):
+        """
+        Adds the record of an invocation and returns the size of the batch
+        """
+        with self.lock:
+            self.records.append(record)
+            if self.timer is None and self.flush_interval is not None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+            return len(self.records)
+
+    def flush(self):
+        """
+        Sends the invocations batched so far
+        """
+        with self.lock, self.sending:
+            records, self.records = self.records, []
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not records or self.connection.closed:
+                return
+            try:
+                self.connection.send(records)
+            except (PicklingError, TypeError, AttributeError):
+                self.connection.send([RemoteExpectations.portable(record)
+                                      for record in records])
+
+
+class RemoteExpectations(Expectations):
+    """
+    Expectations of the copy of a wrapper in another process, each
+    invocation is recorded locally and sent to the collector of the
+    original wrapper.
+
+    Invocations are sent in batches of `batch_size`, `flush_interval`
+    seconds after the first invocation of a batch, even when the copy is
+    idle, and when the copy is collected or the process exits.  Results,
+    errors and arguments which cannot be pickled are sent as their repr.
+    The copies of a wrapper in the same process share a single connection
+    to its collector, closed when the process exits
+    """
+    __connections__ = {}
+    __connecting__ = threading.Lock()
+
+    def __init__(self, address, authkey, record='full', last_n=100,
+                 snapshot='reference', batch_size=1000, flush_interval=0.5):
+        super(RemoteExpectations, self).__init__(record, last_n, snapshot)
+        self.batch_size = batch_size
+        self.connection, sending = self.__connect__(address, authkey)
+        self.batch = InvocationBatch(self.connection, sending, flush_interval)
+        util.Finalize(self, self.batch.flush, exitpriority=10)
+
+    @classmethod
+    def __connect__(cls, address, authkey):
+        """
+        Returns the connection of this process to the collector at address
+        and the lock sending on it, connecting when there is none yet
+        """
+        key = (os.getpid(), address)
+        with cls.__connecting__:
+            try:
+                return cls.__connections__[key]
+            except KeyError:
+                pass
+            connection = Client(address, authkey=authkey)
+            connection.recv()
+            shared = cls.__connections__[key] = (connection, threading.Lock())
+            util.Finalize(None, connection.close, exitpriority=5)
+            return shared
+
+    @staticmethod
+    def record(invocation):
+        """
+        Returns the fields of an invocation as a tuple to be sent
+        """
+        return (invocation.name, invocation.args, invocation.kwargs,
+                invocation.timestamp, invocation.duration,
+                invocation.cpu_duration, invocation.result, invocation.error)
+
+    @staticmethod
+    def invocation(record):
+        """
+        Returns the invocation of a tuple which was sent
+        """
+        name, args, kwargs = record[:3]
+        invocation = Invocation(name, *args, **kwargs)
+        invocation.timestamp, invocation.duration, invocation.cpu_duration, \
+            invocation.result, invocation.error = record[3:]
+        return invocation
+
+    @staticmethod
+    def portable(record):
+        """
+        Returns the record with each value which cannot be pickled replaced
+        by its repr
+        """
+        def value(item):
+            """
+            Return item, or its repr when it cannot be pickled
+            """
+            try:
+                ForkingPickler.dumps(item)
+            except Exception:  # pylint: disable=broad-except
+                return repr(item)
+            return item
+        name, args, kwargs = record[:3]
+        return (name, tuple(value(arg) for arg in args),
+                dict((key, value(arg)) for key, arg in kwargs.items())) + \
+            record[3:6] + (value(record[6]), value(record[7]))
+
+    def notify(self, invocation):
+        recorded = super(RemoteExpectations, self).notify(invocation)
+        if self.batch.append(self.record(invocation)) >= self.batch_size:
+            self.batch.flush()
+        return recorded
+
+    def flush(self):
+        """
+        Sends the invocations batched so far
+        """
+        self.batch.flush()
+
+    def close(self):
+        """
+        Sends the remaining invocations, the shared connection is left open
+        for the other copies
+        """
+        self.flush()
+
+
+class ExpectationsWindow(object):
+    """
+    The expectations of the invocations recorded after a checkpoint, each
+    method is a view of the log shared with the Expectations starting at
+    the position the method had reached at the checkpoint
+    """
+
+    def __init__(self, expectations, mark):
+        self.expectations = expectations
+        self.mark = mark
+
+    def __getattr__(self, name):
+        stats = getattr(self.expectations, name)
+        start = max(self.mark.get(name, 0), stats.start)
+        writes_start = None
+        if stats.writes is not None:
+            writes_start = max(self.mark.get(Wrapper.__setter__(name), 0),
+                               stats.writes.origin)
+        return CallStats(stats.log, start, stats.stop, stats.writes,
+                         writes_start)
+
+
+class VirtualClock(object):
+    """
+    A clock whose time, in milliseconds, only moves when it is advanced.
+
+    The time() and sleep() functions mirror those of the time module so the
+    clock can be handed to the code under test in their place, sleeping
+    advances the clock instantly.
+    """
+
+    def __init__(self, now=0):
+        self.now = now
+        self.__lock__ = threading.Lock()
+
+    def advance(self, milliseconds):
+        """
+        Moves the clock forward by the supplied number of milliseconds
+        """
+        with self.__lock__:
+            self.now += milliseconds
+
+    def time(self):
+        """
+        Returns the current time of the clock in seconds
+        """
+        return self.now / 1000.0
+
+    def sleep(self, seconds):
+        """
+        Advances the clock by the supplied number of seconds
+        """
+        self.advance(seconds * 1000.0)
+
+    async def async_sleep(self, seconds):
+        """
+        Advances the clock by the supplied number of seconds from a coroutine
+        """
+        self.sleep(seconds)
+
+
+class MockActions(object):
+    """
+    A set of actions which can be used to Mock the behaviour of a particular
+    class.
+
+    The specifics registered with when() are also indexed by the shape of
+    their arguments (number of args and keyword names) so that invocations
+    which cannot match any of them never have their arguments hashed.
+    Specifics registered with Matchers are kept in a MatcherTree per shape
+    and are only used when no exact specific exists.
+
+    Delays are simulated against a VirtualClock.
+
+    A limit on the number of invocations, set with expect_at_most or
+    forbid, is checked as each invocation is made against a counter.
+    """
+
+    def __init__(self, clock=None, name=None):
+        self.__action__ = self.original_func
+        self.__clock__ = VirtualClock() if clock is None else clock
+        self.__limit__ = None
+        self.__calls__ = None
+        self.__on_violation__ = None
+        self.name = name
+        self.specifics = {}
+        self.shapes = set()
+        self.patterns = {}
+
+    @staticmethod
+    def shape(args, kwds):
+        """
+        Returns the shape of a set of arguments used to index the specifics
+        """
+        if kwds:
+            return len(args), tuple(sorted(kwds))
+        return len(args), ()
+
+    @classmethod
+    def original_func(cls, original):
+        """
+        Setup to use the original function without any change
+        """
+        return original
+
+    def to_do_this(self, func):
+        """
+        Setup to use the supplied function in place of the original
+        """
+        def to_do_func(original):
+            """
+            Return supplied function
+            """
+            del original
+            return func
+        self.__action__ = to_do_func
+
+    def to_return(self, value):
+        """
+        Setup to invoke the original method but return the supplied value
+        instead of the original return value
+        """
+        def return_func(original):
+            """
+            Return override function
+            """
+            if iscoroutinefunction(original):
+                async def async_override(*args, **kwargs):
+                    """
+                    Await the original and return value
+                    """
+                    await original(*args, **kwargs)
+                    return value
+                return async_override
+
+            def override(*args, **kwargs):
+                """
+                Invoke the original and return value
+                """
+                original(*args, **kwargs)
+                return value
+            return override
+        self.__action__ = return_func
+
+    def to_delay(self, milliseconds):
+        """
+        Setup to invoke the original method after advancing the virtual clock
+        by the supplied number of milliseconds
+        """
+        self.__action__ = self.__delayed__(self.original_func, milliseconds)
+
+    def to_return_after(self, value, milliseconds):
+        """
+        Facade of to_return(value) which advances the virtual clock by the
+        supplied number of milliseconds first
+        """
+        self.to_return(value)
+        self.__action__ = self.__delayed__(self.__action__, milliseconds)
+
+    def __delayed__(self, action, milliseconds):
+        """
+        Returns the action preceded by advancing the virtual clock
+        """
+        clock = self.__clock__
+
+        def delay_func(original):
+            """
+            Return override function
+            """
+            func = action(original)
+
+            def override(*args, **kwargs):
+                """
+                Advance the clock and invoke func
+                """
+                clock.advance(milliseconds)
+                return func(*args, **kwargs)
+            return override
+        return delay_func
+
+    def to_raise(self, throwable):
+        """
+        Setup to raise the supplied exception/error inplace of invoking
+        the original method
+        """
+        def raise_func(original):
+            """
+            Return override function
+            """
+            del original
+
+            def override(*args, **kwargs):
+                """
+                Raise throwable
+                """
+                del args, kwargs
+                raise throwable
+            return override
+        self.__action__ = raise_func
+
+    def to_intercept_with(self, func):
+        """
+        Setup to invoke the supplied function before the original is invoked
+        and the original return value is returned.  The supplied function
+        does not have any effect of the original invocation it simply serves
+        as a way to inspect the arguments being used to invoke the original
+        """
+        def intercept_func(original):
+            """
+            Return override function
+            """
+            if iscoroutinefunction(func):
+                async def async_override(*args, **kwargs):
+                    """
+                    Await func but return the original invocation result
+                    """
+                    await func(*args, **kwargs)
+                    result = original(*args, **kwargs)
+                    if isawaitable(result):
+                        result = await result
+                    return result
+                return async_override
+
+            def override(*args, **kwargs):
+                """
+                Invoke func but return the original invocation result
+                """
+                func(*args, **kwargs)
+                return original(*args, **kwargs)
+
+            return override
+        self.__action__ = intercept_func
+
+    def to_resolve_with(self, value, latency=None):
+        """
+        Setup to return a coroutine resolving with the supplied value inplace
+        of invoking the original method, after sleeping for latency seconds
+        when supplied
+        """
+        def resolve_func(original):
+            """
+            Return override function
+            """
+            del original
+
+            async def override(*args, **kwargs):
+                """
+                Resolve with value
+                """
+                del args, kwargs
+                if latency:
+                    await asyncio.sleep(latency)
+                return value
+            return override
+        self.__action__ = resolve_func
+
+    def to_reject_with(self, throwable, latency=None):
+        """
+        Setup to return a coroutine raising the supplied exception/error
+        inplace of invoking the original method, after sleeping for latency
+        seconds when supplied
+        """
+        def reject_func(original):
+            """
+            Return override function
+            """
+            del original
+
+            async def override(*args, **kwargs):
+                """
+                Reject with throwable
+                """
+                del args, kwargs
+                if latency:
+                    await asyncio.sleep(latency)
+                raise throwable
+            return override
+        self.__action__ = reject_func
+
+    def to_return_sequence(self, iterable):
+        """
+        Setup to return the values of iterable in turn inplace of invoking
+        the original method, the last value is returned again once the
+        iterable is exhausted
+        """
+        lock = threading.Lock()
+        values = iter(iterable)
+        last = [None]
+
+        def next_value():
+            """
+            Return the next value, or the last once there are no more
+            """
+            with lock:
+                for value in values:
+                    last[0] = value
+                    return value
+                return last[0]
+        self.__action__ = self.__sequenced__(next_value)
+
+    def to_cycle(self, iterable):
+        """
+        Setup to return the values of iterable in turn inplace of invoking
+        the original method, starting again from the first value once the
+        iterable is exhausted.  An iterable which can be iterated again is
+        not copied, the values of an iterator are kept as they are returned
+        """
+        lock = threading.Lock()
+        values = [iter(iterable)]
+        if values[0] is iterable:
+            values[0] = cycle(iterable)
+
+        def next_value():
+            """
+            Return the next value, restarting the iterable when exhausted
+            """
+            with lock:
+                for value in values[0]:
+                    return value
+                values[0] = iter(iterable)
+                for value in values[0]:
+                    return value
+                return None
+        self.__action__ = self.__sequenced__(next_value)
+
+    def to_yield_from(self, generator):
+        """
+        Setup to return the values yielded by generator in turn inplace of
+        invoking the original method.  Once the generator is exhausted each
+        invocation raises StopIteration
+        """
+        lock = threading.Lock()
+        values = iter(generator)
+
+        def next_value():
+            """
+            Return the next value yielded
+            """
+            with lock:
+                return next(values)
+        self.__action__ = self.__sequenced__(next_value)
+
+    @staticmethod
+    def __sequenced__(next_value):
+        """
+        Returns the action returning the result of next_value for each
+        invocation, resolving with it when the original is a coroutine
+        function.  Values are only taken as invocations are made
+        """
+        def sequence_func(original):
+            """
+            Return override function
+            """
+            if iscoroutinefunction(original):
+                async def async_override(*args, **kwargs):
+                    """
+                    Resolve with the next value
+                    """
+                    del args, kwargs
+                    return next_value()
+                return async_override
+
+            def override(*args, **kwargs):
+                """
+                Return the next value
+                """
+                del args, kwargs
+                return next_value()
+            return override
+        return sequence_func
+
+    def expect_at_most(self, number, on_violation=None):
+        """
+        Setup to fail as soon as the method is invoked more than number
+        times, instead of when the invocations are asserted.  An
+        AssertionError is raised by the invocation which is one too many
+        unless on_violation is supplied, in which case it is called with
+        the error, e.g. to log it, and the invocation goes ahead
+        """
+        self.__calls__ = count(1)
+        self.__on_violation__ = on_violation
+        self.__limit__ = number
+
+    def forbid(self, on_violation=None):
+        """
+        Facade of expect_at_most(0), the first invocation fails
+        """
+        self.expect_at_most(0, on_violation)
+
+    def __violated__(self, calls):
+        """
+        Fails the invocation which exceeded the limit
+        """
+        name = self.name or 'method'
+        if self.__limit__ == 0:
+            msg = 'forbidden {name} was invoked'.format(name=name)
+        else:
+            msg = '{name} was invoked {calls} times, expected at most ' \
+                '{limit}'.format(name=name, calls=calls, limit=self.__limit__)
+        error = AssertionError(msg)
+        if self.__on_violation__ is None:
+            raise error
+        self.__on_violation__(error)
+
+    def action(self, original, *args, **kwds):
+        """
+        Returns the Mock Action configured for a paricular method.
+        If a more specific Mock Action exists for the supplied arguments
+        then it will be used.
+        """
+        if self.__limit__ is not None:
+            calls = next(self.__calls__)
+            if calls > self.__limit__:
+                self.__violated__(calls)
+
+        if self.shapes or self.patterns:
+            shape = self.shape(args, kwds)
+            specific = None
+            if shape in self.shapes:
+                specific = self.specifics.get(ObjectKey.value(*args, **kwds))
+            if specific is None and shape in self.patterns:
+                specific = self.patterns[shape].find(
+                    self.values(args, kwds, shape))
+            if specific is not None:
+                return specific.action(original, *args, **kwds)
+
+        return self.__action__(original)
+
+    @staticmethod
+    def values(args, kwds, shape):
+        """
+        Returns the args followed by the keyword values in the order of the
+        keyword names of the shape
+        """
+        return args + tuple(kwds[name] for name in shape[1])
+
+    def when(self, *args, **kwds):
+        """
+        Setup a set of MockActions that can be configured in the event that
+        the method is invoked with the supplied set of arguments, any of
+        which can be a Matcher
+        """
+        shape = self.shape(args, kwds)
+        values = self.values(args, kwds, shape)
+        if has_matchers(values):
+            tree = self.patterns.setdefault(shape, MatcherTree())
+            return tree.add(values, MockActions(self.__clock__, self.name))
+
+        key = ObjectKey.value(*args, **kwds)
+        self.specifics[key] = MockActions(self.__clock__, self.name)
+        self.shapes.add(shape)
+        return self.specifics[key]
+
+
+class Setup(object):
+    """
+    A container for the Mock Actions of a class
+    """
+
+    def __init__(self, clock=None):
+        self.__clock__ = VirtualClock() if clock is None else clock
+        self.actions = {}
+
+    def __getattr__(self, name):
+        if name not in self.actions:
+            self.actions[name] = MockActions(self.__clock__, name)
+
+        return self.actions[name]
+
+    def action_for(self, name, original, *args, **kwds):
+        """
+        Returns the action to be used for a particular method
+        """
+        return self.actions[name].action(original, *args, **kwds)
+
+
+class SourceRef(weakref.ref):
+    """
+    Weak reference to a source of a Timeline which knows the id the source
+    was registered with and whether its invocations are kept
+    """
+    __slots__ = ('ident', 'keeps')
+
+    def __new__(cls, source, callback=None, keeps=True):
+        del keeps
+        # weakref.ref.__new__ takes the referent and the callback
+        # pylint: disable=too-many-function-args
+        return super(SourceRef, cls).__new__(cls, source, callback)
+
+    def __init__(self, source, callback=None, keeps=True):
+        super(SourceRef, self).__init__(source, callback)
+        self.ident = id(source)
+        self.keeps = keeps
+
+
+class Timeline(object):
+    """
+    The invocations of several wrappers, stubs or function spies in the
+    order they were made, each entry is a weak reference to the source
+    invoked and the invocation.
+
+    The timeline is append only, the position of an entry is its sequence
+    number.  Appending to a list is atomic so sources called from several
+    threads need no lock.  Sources are only referenced weakly, once a
+    quarter of the registered sources have been collected the entries of
+    the collected ones are replaced by None in a single pass, releasing
+    their invocations without moving the other entries.  The released
+    entries at the start of the timeline are then dropped, `dropped`
+    counts them so that positions do not change.
+
+    Only the invocations of the sources which keep every invocation are
+    recorded, those recording counts or the last n invocations are left
+    out so that the timeline does not hold what they discard.  The entries
+    of a source, or of one of its methods, are released when it is reset
+    or trimmed.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.dropped = 0
+        self.refs = {}
+        self.released = []
+
+    def register(self, source, keeps=True):
+        """
+        Returns the reference to the source recorded with its invocations,
+        which are only recorded when the source keeps them
+        """
+        ref = SourceRef(source, self.__release__, keeps)
+        self.refs[ref.ident] = ref
+        return ref
+
+    def ref_of(self, source):
+        """
+        Returns the reference the source was registered with, if any
+        """
+        ref = self.refs.get(id(source))
+        if ref is not None and ref() is source:
+            return ref
+        return None
+
+    def record(self, ref, invocation):
+        """
+        Appends the invocation of the source registered as ref, unless the
+        source does not keep its invocations
+        """
+        if ref.keeps:
+            self.entries.append((ref, invocation))
+
+    def __release__(self, ref):
+        """
+        Called once a source is collected
+        """
+        self.refs.pop(ref.ident, None)
+        self.released.append(ref)
+        if len(self.released) * 3 >= len(self.refs):
+            self.compact()
+
+    def compact(self):
+        """
+        Replaces the entries of the collected sources by None
+        """
+        released = set(id(ref) for ref in self.released)
+        self.released = []
+        entries = self.entries
+        for position in range(len(entries)):
+            entry = entries[position]
+            if entry is not None and id(entry[0]) in released:
+                entries[position] = None
+        self.__drop_leading__()
+
+    def release(self, ref, stop=None, name=None):
+        """
+        Replaces the entries of the source registered as ref recorded
+        before the position stop, or all of them, by None.  Only those of
+        the named method are replaced when a name is supplied
+        """
+        entries = self.entries
+        if stop is None:
+            stop = self.count
+        for position in range(min(max(stop - self.dropped, 0),
+                                  len(entries))):
+            entry = entries[position]
+            if entry is not None and entry[0] is ref and \
+                    (name is None or entry[1].name == name):
+                entries[position] = None
+        self.__drop_leading__()
+
+    def __drop_leading__(self):
+        """
+        Drops the released entries at the start of the timeline
+        """
+        entries = self.entries
+        leading = 0
+        for entry in entries:
+            if entry is not None:
+                break
+            leading += 1
+        del entries[:leading]
+        self.dropped += leading
+
+    @property
+    def count(self):
+        """
+        The number of invocations ever recorded
         """
-        self.times(0)
+        return self.dropped + len(self.entries)
 
-    def with_arg(self, arg):
+    def between(self, start, stop):
         """
-        Facade of with_args(arg) supplying only a single arg which is the
-        expected
+        Iterates the entries from start up to but excluding stop
         """
-        self.with_args(arg)
+        dropped = self.dropped
+        return islice(self.entries, max(start - dropped, 0),
+                      max(stop - dropped, 0))
 
-    def with_args(self, *args):
+    @staticmethod
+    def describe(source, name):
         """
-        Asserts that an invocation exists which contains the expected args in
-        any order
-
-        Raises an AssertionError if one or more of the expected args does not
-        exist in the actual args of the invocations
+        Returns the name of the method of a source, e.g. Person.greet
         """
-        for invocation in self.invocations:
-            results = []
-            for arg in args:
-                found = False
-                for invocation_arg in invocation.args:
-                    if invocation_arg == arg:
-                        found = True
-                        break
-                results = results + [found]
-            if all(results):
-                return
-        raise AssertionError('invocation matching arguments not found')
-
-    def with_args_strict(self, *args):
+        if isinstance(source, Wrapper):
+            label = source.__label__
+        elif isinstance(source, FunctionSpy):
+            return name
+        else:
+            label = type(source).__name__
+        return '{label}.{name}'.format(label=label, name=name)
+
+    def trace(self):
         """
-        Asserts that an invocation exists which contains the expected args in
-        order defined in the expected args
-
-        Raises an AssertionError if one or more of the expected args does not
-        exist in the actual args of the invocations or if the args exist but
-        not in the expected order
+        Returns the source and the name of the method of each invocation,
+        e.g. Database.connect().cursor
         """
-        for invocation in self.invocations:
-            results = []
-            for _ in args:
-                found = False
-                for index, _ in enumerate(invocation.args):
-                    if len(invocation.args) == len(args) \
-                            and invocation.args[index] == args[index]:
-                        found = True
-                        break
-                results = results + [found]
-            if all(results):
-                return
+        return [self.describe(source, invocation.name)
+                for source, invocation in (
+                    (entry[0](), entry[1]) for entry in self.entries
+                    if entry is not None)
+                if source is not None]
 
-        raise AssertionError('invocation matching arguments not found')
 
-
-class CallStats(object):
+class TimelineView(object):
     """
-    Container for the assertions of the invocations of a method
+    The entries of a Timeline from start up to but excluding stop and, when
+    supplied, of a single source.  A view only holds its bounds, the
+    entries themselves are those of the timeline
     """
 
-    def __init__(self, invocations):
-        self.invocations = invocations
-        self.called = CallAssertions(invocations)
+    def __init__(self, timeline, start=0, stop=None, source=None):
+        if stop is None:
+            stop = timeline.count
+        self.timeline = timeline
+        self.start = start
+        self.stop = stop
+        self.source = source
 
-    def invocation(self, index):
+    def __entries__(self):
         """
-        Returns the specific invocation for the supplied index including
-        all of the expectation functions attached e.g. with_arg,
-        with_args etc...
+        Iterates the source reference and invocation of the entries of the
+        view
+        """
+        entries = self.timeline.between(self.start, self.stop)
+        if self.source is None:
+            return (entry for entry in entries if entry is not None)
+        ref = self.timeline.ref_of(self.source)
+        return (entry for entry in entries
+                if entry is not None and entry[0] is ref)
+
+    @property
+    def invocations(self):
+        """
+        The invocations covered by the view in the order they were made
         """
-        return CallAssertions([self.invocations[index]])
+        return [invocation for _, invocation in self.__entries__()]
 
+    def checkpoint(self):
+        """
+        Returns a mark of the invocations recorded so far, see since
+        """
+        return self.timeline.count
 
-class Expectations(object):
+    def since(self, mark):
+        """
+        Returns the view of the invocations recorded after the mark
+        """
+        return TimelineView(self.timeline, max(mark, self.start), None,
+                            self.source)
+
+    def of(self, source):
+        """
+        Returns the view of the invocations of a single wrapper, stub or
+        function spy
+        """
+        return TimelineView(self.timeline, self.start, self.stop, source)
+
+    @staticmethod
+    def __call_of__(call):
+        """
+        Returns the source and method name of a call given to order, either
+        a method of a wrapper or stub, a function spy or a (source, name)
+        tuple
+        """
+        if isinstance(call, tuple):
+            return call
+        if isinstance(call, FunctionSpy):
+            return call, call.name
+        try:
+            ref, name = call.__deride__
+            return ref(), name
+        except AttributeError:
+            pass
+        if isinstance(getattr(call, '__self__', None), Stub):
+            return call.__self__, call.__name__
+        raise TypeError('{call!r} is not a method of a wrapper, stub or '
+                        'function spy'.format(call=call))
+
+    def order(self, *calls):
+        """
+        Assert that the calls were made in the order supplied, other calls
+        may be made in between.  The view is scanned once
+        """
+        expected = [self.__call_of__(call) for call in calls]
+        refs = [(self.timeline.ref_of(source), name)
+                for source, name in expected]
+        found = 0
+        for ref, invocation in self.__entries__():
+            if found == len(refs):
+                break
+            if ref is refs[found][0] and invocation.name == refs[found][1]:
+                found += 1
+        if found < len(refs):
+            raise AssertionError(
+                'expected the calls {calls} in order, {name} was not called '
+                'after {found}'.format(
+                    calls=', '.join(Timeline.describe(*call)
+                                    for call in expected),
+                    name=Timeline.describe(*expected[found]),
+                    found=', '.join(Timeline.describe(*call)
+                                    for call in expected[:found])
+                    or 'the start'))
+
+
+class Wrapper(object):
     """
-    Container for the expectations for the call assertions
+    A wrapper for the target instance which adds on functionality for
+    Deride.
+
+    The call proxy for each method is built once and cached by name.  A
+    cached proxy is discarded when the attribute is rebound on the target
+    instance or when any attribute of the wrapper (e.g. setup) is replaced.
+
+    A deep wrapper also wraps the collaborators returned by its methods,
+    when they are returned.  The wrappers of a graph share a Timeline and
+    a cache of the wrappers by the identity of their target, holding them
+    weakly, so the same collaborator is always returned with the same
+    wrapper while it is in use.
+
+    The proxies only reference what they use, not the wrapper itself, so a
+    wrapper and its invocation history are released as soon as it is no
+    longer referenced.
+
+    A wrapper created with `processes` can be pickled, the copy records its
+    invocations and sends them back to the original, see RemoteWrapper.
+
+    Reads of the attributes of the target which are not callable are
+    recorded as calls without args and can be setup like methods, the
+    original being the read of the attribute.  Attributes set on the
+    wrapper, other than its own, are set on the target and recorded under
+    the name of the attribute followed by =.  The properties of the target
+    class are read through the descriptors of a Wrapper subclass generated
+    once per class, see Wrapper.__of__, so that they are not looked up on the
+    target first.
     """
+    __own_attributes__ = frozenset(['target', 'expect', 'setup'])
 
-    def __init__(self):
-        self.data = {}
-        self.assertions = {}
+    __collaborators__ = weakref.WeakKeyDictionary()
 
-    def __getattr__(self, name):
+    __classes__ = weakref.WeakKeyDictionary()
+
+    def __init__(self, obj, record='full', last_n=100, snapshot='reference',
+                 threadsafe=False, clock=None, timing=False, sink=None,
+                 deep=False, timeline=None, label=None, graph=None,
+                 processes=False):
+        self.target = obj
+        self.__timing__ = timing
+        self.__deferred__ = timing or sink is not None
+        self.expect = Expectations.create(record, last_n, snapshot,
+                                          threadsafe, sink, processes)
+        self.__remote__ = None
+        if processes:
+            collector = self.expect.collector
+            self.__remote__ = (collector.address, collector.authkey,
+                               record, last_n, snapshot)
+        self.setup = Setup(clock)
+        self.__label__ = type(obj).__name__ if label is None else label
+        if deep and timeline is None:
+            timeline = Timeline()
+        self.__timeline__ = timeline
+        self.__source__ = None
+        if timeline is not None:
+            self.__source__ = timeline.register(self, record == 'full')
+            self.expect.__timeline__ = (timeline, self.__source__)
+        self.__deep__ = self.__collaborator__ if deep is True else deep
+        if deep and graph is None:
+            graph = weakref.WeakValueDictionary()
+            graph[id(obj)] = self
+        self.__graph__ = graph
+        self.__options__ = dict(record=record, last_n=last_n,
+                                snapshot=snapshot, threadsafe=threadsafe,
+                                timing=timing)
+
+    @classmethod
+    def __of__(cls, wrapped):
+        """
+        Returns the wrapper class for instances of the wrapped class, with a
+        descriptor recording the reads of each of its properties other than
+        those named as an attribute of the wrapper itself
+        """
         try:
-            return self.assertions[name]
+            return cls.__classes__[wrapped]
         except KeyError:
-            return CallStats([])
+            pass
 
-    def reset(self):
+        namespace = {}
+        reserved = cls.__own_attributes__.union(dir(cls))
+        for name in dir(wrapped):
+            if name in reserved:
+                continue
+            if isinstance(getattr(wrapped, name, None), PROPERTY_TYPES):
+                namespace[name] = cls.__property__(name)
+
+        generated = cls
+        if namespace:
+            generated = type(wrapped.__name__ + 'Wrapper', (cls,), namespace)
+        cls.__classes__[wrapped] = generated
+        return generated
+
+    @staticmethod
+    def __property__(name):
         """
-        Removes all existing statistics of any methods being tracked
+        Builds the descriptor reading the named property of the target
         """
-        self.assertions = {}
+        def read(self):
+            """
+            Record the read of the property and return its value
+            """
+            target = self.target
+            return self.__read__(name, lambda: getattr(target, name))
+        return property(read)
 
-    def notify(self, invocation):
+    @staticmethod
+    def __setter__(name):
         """
-        Updates the call stats with the next invocation.
+        Returns the name the writes of an attribute are recorded under
         """
-        name = invocation.name
-
-        if name not in self.data:
-            self.data[name] = []
-
-        self.data[name] = self.data[name] + [invocation]
+        return name + '='
+
+    def __setattr__(self, name, value):
+        if name in self.__own_attributes__ or \
+                (name.startswith('__') and name.endswith('__')):
+            object.__setattr__(self, name, value)
+            object.__setattr__(self, '__proxies__', {})
+            return
+        invocation = Invocation(self.__setter__(name), value)
+        invocation.timestamp = self.setup.__clock__.now
+        self.__publish__(invocation)
+        setattr(self.target, name, value)
+
+    def __read__(self, name, read):
+        """
+        Records the read of the named attribute and returns the value of
+        read, or of the action setup for the attribute
+        """
+        action = self.setup.actions.get(name)
+        if action is not None:
+            read = action.action(read)
+        invocation = Invocation(name)
+        invocation.timestamp = self.setup.__clock__.now
+        self.__publish__(invocation)
+        return read()
 
-        self.assertions[name] = CallStats(self.data[name])
+    def __publish__(self, invocation):
+        """
+        Records an invocation which is not made through a proxy
+        """
+        recorded = self.expect.notify(invocation)
+        if self.__timeline__ is not None:
+            self.__timeline__.record(self.__source__, recorded)
 
+    def __reduce__(self):
+        if self.__remote__ is None:
+            raise TypeError('only a wrapper created with processes=True can '
+                            'be pickled')
+        return RemoteWrapper, (self.target,) + self.__remote__
 
-class MockActions(object):
-    """
-    A set of actions which can be used to Mock the behaviour of a particular
-    class
-    """
+    def __getattr__(self, name):
+        own = self.__own__(name)
+        try:
+            cached, proxy = self.__proxies__[name]
+            if cached is own:
+                return proxy
+        except KeyError:
+            pass
 
-    def __init__(self):
-        self.__action__ = self.original_func
-        self.specifics = {}
+        attr = getattr(self.target, name)
+        if not callable(attr):
+            return self.__read__(name, lambda: attr)
+
+        if iscoroutinefunction(attr):
+            proxy = self.__async_proxy__(name)
+        elif self.__deferred__:
+            proxy = self.__deferred_proxy__(name)
+        else:
+            proxy = self.__proxy__(name)
+        proxy.__deride__ = (weakref.ref(self), name)
+        self.__proxies__[name] = (own, proxy)
+        return proxy
+
+    def __own__(self, name):
+        """
+        Returns the attribute bound directly on the target instance, if any
+        """
+        try:
+            return vars(self.target).get(name)
+        except TypeError:
+            return None
 
     @classmethod
-    def original_func(cls, original):
+    def __collaborator__(cls, value):
         """
-        Setup to use the original function without any change
+        Returns whether a returned value is wrapped by a deep wrapper, which
+        is the case for instances of the classes of the code under test.
+        Builtin and standard library types, value types, dataclasses and the
+        objects of Deride itself are not wrapped.  The decision is made once
+        per type
+        """
+        kind = type(value)
+        try:
+            return cls.__collaborators__[kind]
+        except KeyError:
+            pass
+        wrapped = kind not in ATOMIC_TYPES and \
+            not is_stdlib(kind.__module__) and \
+            not issubclass(kind, (Wrapper, Stub, FunctionSpy)) and \
+            not is_value_type(kind) and \
+            not (is_dataclass is not None and is_dataclass(kind))
+        cls.__collaborators__[kind] = wrapped
+        return wrapped
+
+    def __deepener__(self):
+        """
+        Returns the function which returns the wrapper of a collaborator
+        returned by a method, or the value itself when it is not wrapped.
+        None is returned when the wrapper is not deep
         """
-        def override(*args, **kwargs):
+        graph = self.__graph__
+        if graph is None:
+            return None
+        deep = self.__deep__
+        clock = self.setup.__clock__
+        timeline = self.__timeline__
+        label = self.__label__
+        options = self.__options__
+
+        def deepen(name, value):
             """
-            Return original function
+            Return the wrapper of value returned by the named method
             """
-            return original(*args, **kwargs)
-        return override
-
-    def to_do_this(self, func):
+            if not deep(value):
+                return value
+            wrapper = graph.get(id(value))
+            if wrapper is None:
+                wrapper = graph.setdefault(
+                    id(value), Wrapper.__of__(type(value))(
+                        value, clock=clock, deep=deep, timeline=timeline,
+                        label='{label}.{name}()'.format(label=label,
+                                                        name=name),
+                        graph=graph, **options))
+            return wrapper
+        return deepen
+
+    def __proxy__(self, name):
         """
-        Setup to use the supplied function in place of the original
+        Builds the method wrapper for the named method of the target
         """
-        def to_do_func(original):
+        target = self.target
+        actions = self.setup.actions
+        clock = self.setup.__clock__
+        publish = self.__publisher__()
+        deepen = self.__deepener__()
+
+        def call(*args, **kwds):
             """
-            Return supplied function
+            Method wrapper which does the magic
             """
-            del original
-            return func
-        self.__action__ = to_do_func
+            func = getattr(target, name)
+            action = actions.get(name)
+            if action is not None:
+                func = action.action(func, *args, **kwds)
+            invocation = Invocation(name, *args, **kwds)
+            invocation.timestamp = clock.now
+            publish(invocation)
+            if deepen is None:
+                return func(*args, **kwds)
+            return deepen(name, func(*args, **kwds))
+        return call
 
-    def to_return(self, value):
+    def __deferred_proxy__(self, name):
         """
-        Setup to invoke the original method but return the supplied value
-        instead of the original return value
+        Builds the method wrapper for the named method of the target which
+        records the invocation once the method returns, along with its
+        result or error and, when timing, its wall clock and cpu durations
         """
-        def return_func(original):
+        target = self.target
+        actions = self.setup.actions
+        clock = self.setup.__clock__
+        publish = self.__publisher__()
+        timing = self.__timing__
+        deepen = self.__deepener__()
+
+        def call(*args, **kwds):
             """
-            Return override function
+            Method wrapper which does the magic and records the outcome
             """
-            def override(*args, **kwargs):
-                """
-                Invoke the original and return value
-                """
-                original(*args, **kwargs)
-                return value
-            return override
-        self.__action__ = return_func
-
-    def to_raise(self, throwable):
+            func = getattr(target, name)
+            action = actions.get(name)
+            if action is not None:
+                func = action.action(func, *args, **kwds)
+            invocation = Invocation(name, *args, **kwds)
+            invocation.timestamp = clock.now
+            started, cpu_started = perf_counter(), thread_time()
+            try:
+                invocation.result = func(*args, **kwds)
+                if deepen is None:
+                    return invocation.result
+                return deepen(name, invocation.result)
+            except BaseException as error:
+                invocation.error = error
+                raise
+            finally:
+                if timing:
+                    invocation.duration = (perf_counter() - started) * 1000
+                    invocation.cpu_duration = \
+                        (thread_time() - cpu_started) * 1000
+                publish(invocation)
+        return call
+
+    def __async_proxy__(self, name):
         """
-        Setup to raise the supplied exception/error inplace of invoking
-        the original method
+        Builds the method wrapper for the named coroutine method of the
+        target, the invocation is recorded once the coroutine completes.
+        When timing, only the wall clock duration is recorded as the cpu
+        time of a coroutine is shared with the rest of the event loop
         """
-        def raise_func(original):
+        target = self.target
+        actions = self.setup.actions
+        clock = self.setup.__clock__
+        publish = self.__publisher__()
+        timing = self.__timing__
+        deepen = self.__deepener__()
+
+        async def call(*args, **kwds):
             """
-            Return override function
+            Coroutine method wrapper which does the magic
             """
-            del original
-
-            def override(*args, **kwargs):
-                """
-                Raise throwable
-                """
-                del args, kwargs
-                raise throwable
-            return override
-        self.__action__ = raise_func
-
-    def to_intercept_with(self, func):
+            func = getattr(target, name)
+            action = actions.get(name)
+            if action is not None:
+                func = action.action(func, *args, **kwds)
+            invocation = Invocation(name, *args, **kwds)
+            invocation.timestamp = clock.now
+            started = perf_counter()
+            try:
+                result = func(*args, **kwds)
+                if isawaitable(result):
+                    result = await result
+                invocation.result = result
+                if deepen is None:
+                    return result
+                return deepen(name, result)
+            except BaseException as error:
+                invocation.error = error
+                raise
+            finally:
+                if timing:
+                    invocation.duration = (perf_counter() - started) * 1000
+                publish(invocation)
+        return call
+
+    def __publisher__(self):
         """
-        Setup to invoke the supplied function before the original is invoked
-        and the original return value is returned.  The supplied function
-        does not have any effect of the original invocation it simply serves
-        as a way to inspect the arguments being used to invoke the original
+        Returns the function recording an invocation in the expectations
+        and, when there is one, the timeline
         """
-        def intercept_func(original):
+        notify = self.expect.notify
+        if self.__timeline__ is None:
+            return notify
+        record = self.__timeline__.record
+        source = self.__source__
+
+        def publish(invocation):
             """
-            Return override function
+            Record the invocation
             """
-            def override(*args, **kwargs):
-                """
-                Invoke func but return the original invocation result
-                """
-                func(*args, **kwargs)
-                return original(*args, **kwargs)
+            record(source, notify(invocation))
+        return publish
 
-            return override
-        self.__action__ = intercept_func
 
-    def action(self, original, *args, **kwds):
+class RemoteWrapper(Wrapper):
+    """
+    The copy of a wrapper created with processes=True once unpickled,
+    usually in another process.
+
+    The target is pickled along with the wrapper, the setup is not so the
+    copy starts with the original behaviour.  Its invocations are recorded
+    by RemoteExpectations which sends them to the original wrapper, where
+    the arguments are compared by equality as they are copies.
+    """
+
+    def __init__(self, obj, address, authkey, record='full', last_n=100,
+                 snapshot='reference'):
+        super(RemoteWrapper, self).__init__(obj, record, last_n, snapshot)
+        self.expect = RemoteExpectations(address, authkey, record, last_n,
+                                         snapshot)
+        self.__remote__ = (address, authkey, record, last_n, snapshot)
+
+
+class Stub(object):
+    """
+    Base class of the classes generated by Deride.stub.
+
+    A stub class has a real method for each public method of the stubbed
+    class, which records the invocation and does nothing unless setup
+    otherwise.  The methods are plain class attributes so they are found
+    by the normal attribute lookup, methods named as an attribute of Stub
+    itself are left out.  Stub classes are generated once per stubbed
+    class.
+    """
+    __slots__ = ('expect', 'setup', '__timeline__', '__source__',
+                 '__weakref__')
+
+    __classes__ = weakref.WeakKeyDictionary()
+
+    def __init__(self, expect, setup, timeline=None):
+        self.expect = expect
+        self.setup = setup
+        self.__timeline__ = timeline
+        self.__source__ = None
+        if timeline is not None:
+            self.__source__ = timeline.register(self, expect.__keeps__)
+            expect.__timeline__ = (timeline, self.__source__)
+
+    @classmethod
+    def __of__(cls, stubbed):
         """
-        Returns the Mock Action configured for a paricular method.
-        If a more specific Mock Action exists for the supplied arguments
-        then it will be used.
+        Returns the stub class for the stubbed class
         """
         try:
-            key = ObjectKey.value(*args, **kwds)
-            result = self.specifics[key].action(original, *args, **kwds)
-            return result
+            return cls.__classes__[stubbed]
         except KeyError:
             pass
 
-        return self.__action__(original)
+        namespace = {'__slots__': ()}
+        reserved = frozenset(dir(cls))
+        for name in dir(stubbed):
+            if name.startswith('_') or name in reserved:
+                continue
+            attr = getattr(stubbed, name, None)
+            if iscoroutinefunction(attr):
+                namespace[name] = cls.__async_method__(name)
+            elif callable(attr):
+                namespace[name] = cls.__method__(name)
+
+        generated = type(stubbed.__name__ + 'Stub', (cls,), namespace)
+        cls.__classes__[stubbed] = generated
+        return generated
 
-    def when(self, *args, **kwds):
+    @staticmethod
+    def __method__(name):
         """
-        Setup a set of MockActions that can be configured in the event that
-        the method is invoked with the supplied set of arguments
+        Builds the stub method with the supplied name
         """
-        key = ObjectKey.value(*args, **kwds)
-        self.specifics[key] = MockActions()
-        return self.specifics[key]
-
+        def nothing(*args, **kwds):
+            """
+            The original of a stub method
+            """
+            del args, kwds
 
-class Setup(object):
-    """
-    A container for the Mock Actions of a class
-    """
+        def method(self, *args, **kwds):
+            """
+            Stub method which records the invocation
+            """
+            func = nothing
+            action = self.setup.actions.get(name)
+            if action is not None:
+                func = action.action(nothing, *args, **kwds)
+            invocation = Invocation(name, *args, **kwds)
+            invocation.timestamp = self.setup.__clock__.now
+            invocation = self.expect.notify(invocation)
+            if self.__timeline__ is not None:
+                self.__timeline__.record(self.__source__, invocation)
+            return func(*args, **kwds)
+        method.__name__ = name
+        return method
 
-    def __init__(self):
-        self.actions = {}
+    @staticmethod
+    def __async_method__(name):
+        """
+        Builds the coroutine stub method with the supplied name
+        """
+        async def nothing(*args, **kwds):
+            """
+            The original of a coroutine stub method
+            """
+            del args, kwds
 
-    def __getattr__(self, name):
-        if name not in self.actions:
-            self.actions[name] = MockActions()
+        async def method(self, *args, **kwds):
+            """
+            Coroutine stub method which records the invocation
+            """
+            func = nothing
+            action = self.setup.actions.get(name)
+            if action is not None:
+                func = action.action(nothing, *args, **kwds)
+            invocation = Invocation(name, *args, **kwds)
+            invocation.timestamp = self.setup.__clock__.now
+            try:
+                result = func(*args, **kwds)
+                if isawaitable(result):
+                    result = await result
+                invocation.result = result
+                return result
+            except BaseException as error:
+                invocation.error = error
+                raise
+            finally:
+                recorded = self.expect.notify(invocation)
+                if self.__timeline__ is not None:
+                    self.__timeline__.record(self.__source__, recorded)
+        method.__name__ = name
+        return method
+
+
+class FunctionSpy(object):
+    """
+    A callable which records its invocations before invoking the spied
+    function, or doing nothing when there is none.
 
-        return self.actions[name]
+    The spy has a single method so its MockActions and invocation log are
+    held directly, expect is the CallStats of the function and setup its
+    MockActions.
+    """
+    __slots__ = ('fn', 'name', 'setup', '__timeline__', '__log__', '__clock__',
+                 '__source__', '__weakref__')
+
+    def __init__(self, fn=None, record='full', last_n=100, clock=None,
+                 timeline=None):
+        self.fn = self.nothing if fn is None else fn
+        self.name = getattr(fn, '__name__', 'func')
+        self.__clock__ = VirtualClock() if clock is None else clock
+        self.setup = MockActions(self.__clock__, self.name)
+        self.__timeline__ = timeline
+        self.__source__ = None if timeline is None \
+            else timeline.register(self, record == 'full')
+        self.__log__ = Expectations(record, last_n).__new_log__()
+        if self.__source__ is not None and self.__source__.keeps:
+            self.__log__.source = (timeline, self.__source__, self.name)
 
-    def action_for(self, name, original, *args, **kwds):
+    @staticmethod
+    def nothing(*args, **kwds):
         """
-        Returns the action to be used for a particular method
+        The function spied on when none is supplied
         """
-        return self.actions[name].action(original, *args, **kwds)
+        del args, kwds
 
-
-class Wrapper(object):
+    @property
+    def expect(self):
+        """
+        The CallStats of the invocations recorded so far
+        """
+        return CallStats(self.__log__)
+
+    def __call__(self, *args, **kwds):
+        func = self.setup.action(self.fn, *args, **kwds)
+        log = self.__log__
+        if log.keeps:
+            invocation = Invocation(self.name, *args, **kwds)
+            invocation.timestamp = self.__clock__.now
+            log.append(invocation)
+            if self.__timeline__ is not None:
+                self.__timeline__.record(self.__source__, invocation)
+        else:
+            log.append(None)
+        return func(*args, **kwds)
+
+
+class HybridMethod(object):
     """
-    A wrapper for the target instance which adds on functionality for
-    Deride
+    Decorator for a method which is called with the class when called on
+    the class, like a classmethod, and with the instance when called on an
+    instance
     """
 
-    def __init__(self, obj):
-        self.target = obj
-        self.expect = Expectations()
-        self.setup = Setup()
-
-    def __getattr__(self, name):
-        try:
-            if not getattr(self.target, name).__call__:
-                raise AttributeError('not a function')
-
-            def call(*args, **kwds):
-                """
-                Method wrapper which does the magic
-                """
-                func = getattr(self.target, name)
-                try:
-                    func = self.setup.action_for(name, func, *args, **kwds)
-                except KeyError:
-                    pass
-                self.__publish__(Invocation(name, *args, **kwds))
-                return func(*args, **kwds)
-            return call
-        except AttributeError:
-            return getattr(self.target, name)
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
 
-    def __publish__(self, invocation):
-        self.expect.notify(invocation)
+    def __get__(self, instance, owner):
+        return MethodType(self.func, owner if instance is None else instance)
 
 
 class Deride(object):
     """
     Main class for the package Deride
+
+    The wrappers, stubs and function spies created by an instance record
+    their invocations in its timeline so that the order of calls across
+    them can be asserted with deride.expect.order.  Those created through
+    the class itself do not.
     """
+    timeline = None
+
+    def __init__(self):
+        self.timeline = Timeline()
+
+    @property
+    def expect(self):
+        """
+        The TimelineView of the invocations recorded so far
+        """
+        return TimelineView(self.timeline)
+
+    def stats(self):
+        """
+        Returns the number of wrappers, stubs and function spies of the
+        instance which are still alive, of the invocations they hold, of the
+        entries held by the timeline and an approximation of the bytes used
+        by Deride to hold them, the arguments themselves are not counted
+        """
+        sources = [ref() for ref in list(self.timeline.refs.values())]
+        sources = [source for source in sources if source is not None]
+        invocations = 0
+        size = 0
+        for source in sources:
+            if isinstance(source, FunctionSpy):
+                logs = [source.__log__]
+            else:
+                logs = source.expect.logs()
+            for log in logs:
+                invocations += len(log.invocations)
+                size += sys.getsizeof(log.invocations) + sum(
+                    self.__footprint__(invocation)
+                    for invocation in log.invocations)
+        entries = self.timeline.entries
+        held = len(entries) - entries.count(None)
+        size += sys.getsizeof(entries) + held * sys.getsizeof((None, None))
+        return {'wrappers': len(sources), 'invocations': invocations,
+                'timeline': held, 'bytes': size}
+
+    @staticmethod
+    def __footprint__(invocation):
+        """
+        Returns the approximate bytes used to record an invocation
+        """
+        values = invocation.args + tuple(invocation.kwargs.values())
+        return sys.getsizeof(invocation) + sys.getsizeof(invocation.args) + \
+            sys.getsizeof(invocation.kwargs) + \
+            sum(sys.getsizeof(value) for value in values
+                if type(value) is weakref.ref)
+
+    @staticmethod
+    def timeline_of(source):
+        """
+        Returns the Timeline the invocations of a wrapper, stub or function
+        spy are recorded in, None when they are not
+        """
+        return getattr(source, '__timeline__', None)
+
+    # The first argument of a HybridMethod is the class or the instance
+    # pylint: disable=no-self-argument
+    @HybridMethod
+    def wrap(deride, obj, record='full', last_n=100, snapshot='reference',
+             threadsafe=False, clock=None, timing=False, sink=None,
+             deep=False, timeline=None, processes=False):
+        """
+        Wrap a target instance to setup and expect behaviour.
+
+        `record` controls how much of the invocation history is kept and
+        `snapshot` what is kept of the arguments, see Expectations.  Use
+        `threadsafe` when the wrapper is called from several threads.
+        Delays are simulated against `clock`, a VirtualClock which can be
+        shared by several wrappers.  With `timing` the duration of each
+        invocation is recorded and summarised in expect.method.timing.
+        Invocations are streamed to `sink`, an InvocationSink, when supplied.
+
+        With `deep` the collaborators returned by the methods are wrapped
+        too, with the same options, as they are returned.  `deep` is either
+        True or a function deciding which returned values are wrapped.  The
+        invocations of every wrapper of the graph are added to `timeline`,
+        a Timeline which is created when not supplied, available as
+        Deride.timeline_of(wrapper).  The timeline of the Deride instance is
+        used when wrap is called on one.
+
+        With `processes` the wrapper can be pickled to other processes, e.g.
+        passed to the tasks of a ProcessPoolExecutor, and the invocations of
+        the copies are added to the expectations of the wrapper as they are
+        sent back
+        """
+        if timeline is None:
+            timeline = deride.timeline
+        return Wrapper.__of__(type(obj))(
+            obj, record, last_n, snapshot, threadsafe, clock, timing, sink,
+            deep, timeline, processes=processes)
+
+    @HybridMethod
+    def stub(deride, stubbed, record='full', last_n=100,
+             snapshot='reference', threadsafe=False, clock=None, sink=None):
+        """
+        Create a stub instance of a class to setup and expect behaviour.
+        Each public method of the class is replaced by one which does
+        nothing, the options are those of wrap
+        """
+        return Stub.__of__(stubbed)(
+            Expectations.create(record, last_n, snapshot, threadsafe, sink),
+            Setup(clock), deride.timeline)
+
+    @HybridMethod
+    def func(deride, fn=None, record='full', last_n=100, clock=None):
+        """
+        Create a spy of a function, or of a function doing nothing when
+        none is supplied, to setup and expect behaviour
+        """
+        return FunctionSpy(fn, record, last_n, clock, deride.timeline)
+    # pylint: enable=no-self-argument
 
     @classmethod
-    def wrap(cls, obj):
+    def replay(cls, source, wrapper, decode=None):
+        """
+        Stubs the methods of a wrapper with the invocations recorded by an
+        InvocationSink, each one becomes a setup.method.when(*args, **kwargs)
+        returning the recorded result without invoking the original.
+        Invocations which raised are not replayed.  Lines are decoded with
+        InvocationSink.from_json unless `decode` is supplied.
+
+        The source, a path or an open text file, is read a line at a time
+        """
+        if decode is None:
+            decode = InvocationSink.from_json
+        if isinstance(source, str):
+            with open(source) as stream:
+                return cls.replay(stream, wrapper, decode)
+
+        for line in source:
+            if not line.strip():
+                continue
+            record = decode(line)
+            if record.get('error') is not None:
+                continue
+            getattr(wrapper.setup, record['name']) \
+                .when(*record['args'], **record['kwargs']) \
+                .to_do_this(cls.__returning__(record['result']))
+        return wrapper
+
+    @staticmethod
+    def __returning__(value):
         """
-        Wrap a target instance to setup and expect behaviour
+        Returns a function which returns value whatever it is invoked with
         """
-        return Wrapper(obj)
+        def returning(*args, **kwargs):
+            """
+            Return value
+            """
+            del args, kwargs
+            return value
+        return returning
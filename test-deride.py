@@ -1,5 +1,25 @@
+import asyncio
+import datetime
+import decimal
+import gc
+import io
+import json
+import pickle
+import threading
+import time
 import unittest
-from pyderide.deride import Deride, ObjectKey
+import weakref
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count
+from operator import methodcaller
+try:
+    from dataclasses import make_dataclass
+except ImportError:  # pragma: no cover
+    make_dataclass = None
+from pyderide.deride import (Any, Deride, InvocationSink, KeyEngine,
+                             ObjectKey, Predicate, RecordingError, Regex,
+                             Timing, VirtualClock)
 
 
 class Logger:
@@ -34,6 +54,112 @@ class Person(object):
         pass
 
 
+class Ledger(object):
+
+    def __init__(self, balances):
+        self.balances = balances
+        self.lookups = 0
+
+    def balance(self, account, currency='GBP'):
+        self.lookups += 1
+        if account not in self.balances:
+            raise KeyError(account)
+        return {'amount': self.balances[account], 'currency': currency}
+
+
+class Cursor(object):
+
+    def execute(self, sql):
+        return [sql]
+
+
+class Connection(object):
+
+    def __init__(self):
+        self.open_cursor = Cursor()
+
+    def cursor(self):
+        return self.open_cursor
+
+    def commit(self):
+        pass
+
+
+class Database(object):
+
+    def __init__(self):
+        self.connection = Connection()
+
+    def connect(self):
+        return self.connection
+
+    def name(self):
+        return 'db'
+
+
+class Config(object):
+
+    def __init__(self):
+        self.loads = 0
+        self.__timeout = 10
+
+    @property
+    def settings(self):
+        self.loads += 1
+        return {'debug': False}
+
+    @property
+    def timeout(self):
+        return self.__timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.__timeout = value
+
+
+class AsyncPerson(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.fetched = 0
+
+    async def fetch(self, other):
+        await asyncio.sleep(0)
+        self.fetched += 1
+        return 'fetched ' + other.name
+
+
+Payment = make_dataclass('Payment', ['amount', 'tags']) \
+    if make_dataclass is not None else None
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class Money(object):
+    __hash__ = None
+
+    def __init__(self, amount):
+        self.amount = amount
+
+
+class Point(object):
+    __hash__ = None
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def __eq__(self, other):
+        return isinstance(other, Point) and \
+            (self.x, self.y) == (other.x, other.y)
+
+
 class TestObjectKey(unittest.TestCase):
 
     def test_returns_key(self):
@@ -41,6 +167,56 @@ class TestObjectKey(unittest.TestCase):
         key2 = ObjectKey.value(2, 3, 4, a=5)
         self.assertNotEquals(key1, key2)
 
+    def test_unhashable_arguments(self):
+        self.assertEqual(ObjectKey.value([1, 2], a={'b': {3}}),
+                         ObjectKey.value([1, 2], a={'b': {3}}))
+        self.assertNotEqual(ObjectKey.value([1, 2]), ObjectKey.value((1, 2)))
+        self.assertEqual(ObjectKey.value({'a': 1, 'b': 2}),
+                         ObjectKey.value({'b': 2, 'a': 1}))
+
+    @unittest.skipIf(Payment is None, 'dataclasses need Python 3.7')
+    def test_dataclass_arguments(self):
+        self.assertEqual(ObjectKey.value(Payment(1.0, ['x'])),
+                         ObjectKey.value(Payment(1.0, ['x'])))
+        self.assertNotEqual(ObjectKey.value(Payment(1.0, ['x'])),
+                            ObjectKey.value(Payment(1.0, ['y'])))
+
+    def test_self_referencing_arguments(self):
+        items = [1]
+        items.append(items)
+        self.assertEqual(ObjectKey.value(items), ObjectKey.value(items))
+
+    def test_unknown_unhashable_matches_by_identity(self):
+        money = Money(1)
+        self.assertEqual(ObjectKey.value(money), ObjectKey.value(money))
+        self.assertNotEqual(ObjectKey.value(money), ObjectKey.value(Money(1)))
+
+    def test_registered_converter(self):
+        engine = KeyEngine()
+        engine.register(Money, lambda value, canonical: value.amount)
+        self.assertEqual(engine.key(Money(1)), engine.key(Money(1)))
+
+
+class TestTiming(unittest.TestCase):
+
+    def test_percentiles(self):
+        timing = Timing()
+        for duration in range(1, 1001):
+            timing.record(float(duration))
+
+        self.assertEqual(timing.count, 1000)
+        self.assertEqual(timing.total, 500500.0)
+        self.assertAlmostEqual(timing.p50, 500, delta=5)
+        self.assertAlmostEqual(timing.p95, 950, delta=10)
+        self.assertAlmostEqual(timing.p99, 990, delta=10)
+        self.assertEqual(timing.percentile(100), 1000)
+        self.assertLess(len(timing.buckets), 1000)
+
+    def test_empty(self):
+        timing = Timing()
+        self.assertIsNone(timing.p50)
+        self.assertIsNone(timing.mean)
+
 
 class TestDeride(unittest.TestCase):
 
@@ -153,6 +329,76 @@ class TestDeride(unittest.TestCase):
 
         bob.expect.greet.called.never()
 
+    def test_reset_method(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        bob.greet(alice)
+        bob.pay(alice, 10)
+
+        bob.expect.greet.reset()
+
+        bob.expect.greet.called.never()
+        bob.expect.pay.called.once()
+        bob.greet(Person('carol'))
+        bob.expect.greet.called.once()
+        with self.assertRaises(AssertionError):
+            bob.expect.greet.called.with_arg(alice)
+
+    def test_called_reset(self):
+        bob = self.deride.wrap(Person('bob'))
+        bob.greet(Person('alice'))
+
+        bob.expect.greet.called.reset()
+
+        bob.expect.greet.called.never()
+
+    def test_since_checkpoint(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        carol = Person('carol')
+        bob.greet(alice)
+        mark = bob.expect.checkpoint()
+        bob.greet(carol)
+        bob.pay(alice, 10)
+
+        bob.expect.since(mark).greet.called.once()
+        bob.expect.since(mark).greet.called.with_arg(carol)
+        bob.expect.since(mark).pay.called.once()
+        self.assertEqual(
+            bob.expect.since(mark).greet.invocation(0).invocations[0].args,
+            (carol,))
+        with self.assertRaises(AssertionError):
+            bob.expect.since(mark).greet.called.with_arg(alice)
+        bob.expect.greet.called.twice()
+
+    def test_trim_to_checkpoint(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        for amount in range(100):
+            bob.pay(alice, amount)
+        bob.expect.pay.called.with_args(alice, 5)
+        mark = bob.expect.checkpoint()
+        bob.pay(alice, 100)
+
+        bob.expect.trim(mark)
+
+        self.assertEqual(len(bob.expect.pay.invocations), 1)
+        bob.expect.pay.called.with_args(alice, 100)
+        bob.expect.since(mark).pay.called.once()
+        with self.assertRaises(AssertionError):
+            bob.expect.pay.called.with_args(alice, 5)
+
+    def test_checkpoint_survives_reset(self):
+        bob = self.deride.wrap(Person('bob'), record='last_n', last_n=5)
+        alice = Person('alice')
+        bob.greet(alice)
+        mark = bob.expect.checkpoint()
+        bob.greet(alice)
+        bob.expect.reset()
+        bob.greet(alice)
+
+        bob.expect.since(mark).greet.called.once()
+
     def test_with_arg(self):
         bob = Person('bob')
         bob = self.deride.wrap(bob)
@@ -212,6 +458,197 @@ class TestDeride(unittest.TestCase):
         with self.assertRaises(AssertionError):
             bob.expect.pay.called.with_args_strict(25.00, alice)
 
+    def test_with_args_strict_fails_on_partial_match(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        bob.pay(alice, 25.00)
+
+        with self.assertRaises(AssertionError):
+            bob.expect.pay.called.with_args_strict(alice, 35.00)
+
+    def test_with_args_unhashable(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        bob.pay(alice, [25.00])
+        bob.pay(alice, 10.00)
+
+        bob.expect.pay.called.with_args([25.00], alice)
+        bob.expect.pay.called.with_args([25.00])
+        bob.expect.pay.called.with_args_strict(alice, [25.00])
+        bob.expect.pay.called.with_args_strict(alice, 10.00)
+        with self.assertRaises(AssertionError):
+            bob.expect.pay.called.with_args([25.00], 10.00)
+        with self.assertRaises(AssertionError):
+            bob.expect.pay.called.with_args_strict([25.00], alice)
+
+    def test_with_args_only_sees_invocations_at_read_time(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        carol = Person('carol')
+        bob.greet(alice)
+
+        greet = bob.expect.greet
+        bob.greet(carol)
+
+        greet.called.with_arg(alice)
+        with self.assertRaises(AssertionError):
+            greet.called.with_arg(carol)
+        with self.assertRaises(AssertionError):
+            greet.called.with_args_strict(carol)
+        bob.expect.greet.called.with_arg(carol)
+
+    def test_record_counts(self):
+        bob = self.deride.wrap(Person('bob'), record='counts')
+        alice = Person('alice')
+        bob.greet(alice)
+        bob.greet(alice)
+
+        bob.expect.greet.called.twice()
+        bob.expect.greet.called.lt(3)
+        with self.assertRaises(RecordingError):
+            bob.expect.greet.called.with_arg(alice)
+        with self.assertRaises(RecordingError):
+            bob.expect.greet.invocation(0)
+
+    def test_record_last_n(self):
+        bob = self.deride.wrap(Person('bob'), record='last_n', last_n=2)
+        alice = Person('alice')
+        carol = Person('carol')
+        bob.greet(alice)
+        bob.greet(carol)
+        bob.greet(bob)
+
+        bob.expect.greet.called.times(3)
+        bob.expect.greet.called.with_arg(carol)
+        bob.expect.greet.invocation(2).with_arg(bob)
+        with self.assertRaises(AssertionError):
+            bob.expect.greet.called.with_arg(alice)
+        with self.assertRaises(RecordingError):
+            bob.expect.greet.invocation(0)
+
+    def test_record_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            self.deride.wrap(Person('bob'), record='everything')
+
+    def test_invocations_are_slotted(self):
+        bob = self.deride.wrap(Person('bob'))
+        bob.greet(Person('alice'))
+
+        invocation = bob.expect.greet.invocations[0]
+        self.assertFalse(hasattr(invocation, '__dict__'))
+        self.assertEqual(invocation.name, 'greet')
+
+    def test_snapshot_copy(self):
+        bob = self.deride.wrap(Person('bob'), snapshot='copy')
+        alice = Person('alice')
+        amounts = [25.00]
+        bob.pay(alice, amounts)
+        amounts.append(35.00)
+
+        bob.expect.pay.called.with_args([25.00])
+        bob.expect.pay.invocation(0).with_arg([25.00])
+
+    def test_snapshot_summary(self):
+        bob = self.deride.wrap(Person('bob'), snapshot=repr)
+        alice = Person('alice')
+        bob.pay(alice, [25.00] * 1000)
+
+        self.assertEqual(bob.expect.pay.invocations[0].args[0], repr(alice))
+        bob.expect.pay.called.with_args_strict(alice, [25.00] * 1000)
+        bob.expect.pay.invocation(0).with_arg([25.00] * 1000)
+        with self.assertRaises(AssertionError):
+            bob.expect.pay.called.with_arg([35.00])
+
+    def test_threadsafe_recording(self):
+        for record in ('full', 'last_n', 'counts'):
+            bob = self.deride.wrap(Person('bob'), record=record,
+                                   threadsafe=True)
+            alice = Person('alice')
+
+            def greet():
+                for _ in range(1000):
+                    bob.greet(alice)
+
+            threads = [threading.Thread(target=greet) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            bob.expect.greet.called.lte(8000)
+            for thread in threads:
+                thread.join()
+
+            bob.expect.greet.called.times(8000)
+
+    def test_threadsafe_last_invocation_of_exiting_thread(self):
+        bob = self.deride.wrap(Person('bob'), threadsafe=True)
+        alice = Person('alice')
+        bob.greet(alice)
+
+        class Exiting(object):
+
+            @staticmethod
+            def is_alive():
+                bob.greet(alice)
+                return False
+
+        expect = bob.expect
+        expect.__buffers__ = [(Exiting(), buffer)
+                              for _, buffer in expect.__buffers__]
+
+        bob.expect.greet.called.twice()
+
+    def test_with_all(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        for amount in range(100):
+            bob.pay(alice, amount)
+        bob.pay(alice, [1, 2])
+
+        bob.expect.pay.called.with_all([(alice, 1), (alice, 99),
+                                        (alice, [1, 2])])
+        with self.assertRaises(AssertionError) as context:
+            bob.expect.pay.called.with_all([(alice, 1), (alice, 100),
+                                            (alice, [2, 1]), (1, alice)])
+        message = str(context.exception)
+        self.assertIn('100', message)
+        self.assertIn('[2, 1]', message)
+        self.assertNotIn(', 1)', message)
+
+    def test_with_all_single_args(self):
+        bob = self.deride.wrap(Person('bob'), record='last_n', last_n=10)
+        alice = Person('alice')
+        carol = Person('carol')
+        bob.greet(alice)
+        bob.greet(carol)
+
+        bob.expect.greet.called.with_all([alice, carol])
+        with self.assertRaises(AssertionError):
+            bob.expect.greet.called.with_all([alice, bob])
+
+    def test_with_all_equal_unhashable_args(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        bob.pay(alice, Point(1, 2))
+        bob.pay(alice, [Point(3, 4)])
+
+        bob.expect.pay.called.with_all([(alice, Point(1, 2)),
+                                        (alice, [Point(3, 4)])])
+        with self.assertRaises(AssertionError):
+            bob.expect.pay.called.with_all([(alice, Point(1, 3))])
+
+    def test_with_sequence(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        for amount in range(10):
+            bob.pay(alice, amount)
+
+        bob.expect.pay.called.with_sequence([(alice, 1), (alice, 5),
+                                             (alice, 9)])
+        with self.assertRaises(AssertionError) as context:
+            bob.expect.pay.called.with_sequence([(alice, 5), (alice, 1),
+                                                 (alice, 9)])
+        self.assertIn(', 1)', str(context.exception))
+        self.assertNotIn(', 5)', str(context.exception))
+
     def test_to_do_this(self):
         bob = Person('bob')
         bob = self.deride.wrap(bob)
@@ -233,6 +670,124 @@ class TestDeride(unittest.TestCase):
         result = bob.greet(alice)
         self.assertEquals(result, 'foobar')
 
+    def test_to_return_sequence(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        bob.setup.greet.to_return_sequence(['a', 'b'])
+
+        self.assertEqual([bob.greet(alice) for _ in range(3)],
+                         ['a', 'b', 'b'])
+
+    def test_to_return_sequence_is_lazy(self):
+        bob = self.deride.wrap(Person('bob'))
+        produced = []
+
+        def pages():
+            for page in count():
+                produced.append(page)
+                yield page
+
+        bob.setup.greet.to_return_sequence(pages())
+        self.assertEqual(produced, [])
+        bob.greet(Person('alice'))
+        self.assertEqual(produced, [0])
+
+    def test_to_cycle(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        bob.setup.greet.to_cycle(['a', 'b'])
+        bob.setup.credit_with.to_cycle(iter('xy'))
+
+        self.assertEqual([bob.greet(alice) for _ in range(5)],
+                         ['a', 'b', 'a', 'b', 'a'])
+        self.assertEqual([bob.credit_with(1) for _ in range(3)],
+                         ['x', 'y', 'x'])
+
+    def test_to_yield_from(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        bob.setup.greet.to_yield_from(name for name in ('a', 'b'))
+
+        self.assertEqual([bob.greet(alice), bob.greet(alice)], ['a', 'b'])
+        with self.assertRaises(StopIteration):
+            bob.greet(alice)
+
+    def test_to_return_sequence_with_when(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        carol = Person('carol')
+        bob.setup.greet.when(alice).to_return_sequence([1, 2])
+        bob.setup.greet.when(carol).to_cycle([3])
+
+        self.assertEqual([bob.greet(alice), bob.greet(carol),
+                          bob.greet(alice), bob.greet(carol)], [1, 3, 2, 3])
+
+    def test_to_yield_from_threads(self):
+        bob = self.deride.wrap(Person('bob'), threadsafe=True)
+        alice = Person('alice')
+        bob.setup.greet.to_yield_from(iter(range(4000)))
+        results = []
+
+        def greet():
+            for _ in range(1000):
+                results.append(bob.greet(alice))
+
+        workers = [threading.Thread(target=greet) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(sorted(results), list(range(4000)))
+
+    def test_expect_at_most(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        bob.setup.greet.expect_at_most(2)
+
+        bob.greet(alice)
+        bob.greet(alice)
+        with self.assertRaises(AssertionError) as raised:
+            bob.greet(alice)
+        self.assertIn('greet was invoked 3 times', str(raised.exception))
+        bob.expect.greet.called.twice()
+
+    def test_forbid(self):
+        bob = self.deride.wrap(Person('bob'))
+        bob.setup.pay.forbid()
+
+        with self.assertRaises(AssertionError):
+            bob.pay(Person('alice'), 10)
+        bob.expect.pay.called.never()
+
+    def test_forbid_when(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        carol = Person('carol')
+        bob.setup.greet.when(carol).forbid()
+
+        bob.greet(alice)
+        with self.assertRaises(AssertionError):
+            bob.greet(carol)
+
+    def test_expect_at_most_on_violation(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        violations = []
+        bob.setup.greet.expect_at_most(1, on_violation=violations.append)
+
+        for _ in range(3):
+            self.assertEqual(bob.greet(alice), 'hello alice')
+        self.assertEqual([str(error) for error in violations], [
+            'greet was invoked 2 times, expected at most 1',
+            'greet was invoked 3 times, expected at most 1'])
+
+    def test_forbid_spy(self):
+        delete = self.deride.func()
+        delete.setup.forbid()
+
+        with self.assertRaises(AssertionError):
+            delete('everything')
+
     def test_to_raise(self):
         bob = Person('bob')
         alice = Person('alice')
@@ -321,6 +876,230 @@ class TestDeride(unittest.TestCase):
         self.assertTrue(Logger.has_message('bob'))
         self.assertEqual(len(Logger.messages), 2)
 
+    def test_specific_with_keyword_arguments(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+
+        bob.setup.pay.when(alice, amount=10).to_return('ten')
+
+        self.assertEquals(bob.pay(alice, amount=10), 'ten')
+        self.assertEquals(bob.pay(alice, 10), None)
+        self.assertEquals(bob.pay(alice, amount=20), None)
+
+    def test_specific_ignores_other_argument_shapes(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+
+        bob.setup.pay.when(alice).to_return('one arg')
+
+        self.assertEquals(bob.pay(alice, [25.00]), None)
+
+    def test_specific_with_unhashable_arguments(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+
+        bob.setup.pay.when(alice, [1, 2]).to_return('list')
+        bob.setup.pay.when(alice, {'amount': 1}).to_return('dict')
+
+        self.assertEquals(bob.pay(alice, [1, 2]), 'list')
+        self.assertEquals(bob.pay(alice, {'amount': 1}), 'dict')
+        self.assertEquals(bob.pay(alice, [2, 1]), None)
+
+    def test_to_delay(self):
+        clock = VirtualClock()
+        bob = self.deride.wrap(Person('bob'), clock=clock)
+        alice = Person('alice')
+        bob.setup.greet.to_delay(1500)
+
+        self.assertEquals(bob.greet(alice), 'hello alice')
+        self.assertEquals(bob.greet(alice), 'hello alice')
+        self.assertEquals(clock.now, 3000)
+        self.assertEquals(bob.expect.greet.invocations[1].timestamp, 1500)
+
+    def test_to_return_after(self):
+        clock = VirtualClock()
+        bob = self.deride.wrap(Person('bob'), clock=clock)
+        alice = Person('alice')
+        bob.setup.greet.when(alice).to_return_after('timeout', 30000)
+
+        def greet_with_timeout(other, timeout):
+            started = clock.time()
+            result = bob.greet(other)
+            if clock.time() - started > timeout:
+                return 'gave up'
+            return result
+
+        self.assertEquals(greet_with_timeout(alice, 10), 'gave up')
+        self.assertEquals(greet_with_timeout(bob, 10), 'hello bob')
+
+    def test_virtual_backoff(self):
+        clock = VirtualClock()
+        bob = self.deride.wrap(Person('bob'), clock=clock)
+        bob.setup.greet.to_raise(IOError('unavailable'))
+
+        delay = 1.0
+        for _ in range(10):
+            try:
+                bob.greet(Person('alice'))
+            except IOError:
+                clock.sleep(delay)
+                delay *= 2
+
+        bob.expect.greet.called.times(10)
+        self.assertEquals(clock.time(), 1023.0)
+        self.assertEquals(bob.expect.greet.invocation(-1).invocations[0]
+                          .timestamp, 511000.0)
+
+    def test_timing(self):
+        bob = self.deride.wrap(Person('bob'), timing=True)
+        alice = Person('alice')
+        bob.setup.greet.when(alice).to_intercept_with(
+            lambda other: time.sleep(0.02))
+        bob.greet(bob)
+        bob.greet(alice)
+
+        timing = bob.expect.greet.timing
+        self.assertEqual(timing.count, 2)
+        self.assertGreaterEqual(timing.max, 20)
+        self.assertGreaterEqual(bob.expect.greet.invocations[1].duration, 20)
+        bob.expect.greet.called.faster_than(20, percentile=50)
+        bob.expect.greet.called.faster_than(10000)
+        with self.assertRaises(AssertionError):
+            bob.expect.greet.called.faster_than(20)
+
+    def test_timing_of_a_window(self):
+        bob = self.deride.wrap(Person('bob'), timing=True)
+        alice = Person('alice')
+        bob.setup.greet.when(alice).to_intercept_with(
+            lambda other: time.sleep(0.05))
+        bob.greet(alice)
+        mark = bob.expect.checkpoint()
+        bob.greet(bob)
+
+        bob.expect.since(mark).greet.called.faster_than(50)
+        bob.expect.greet.invocation(1).faster_than(50)
+        with self.assertRaises(AssertionError):
+            bob.expect.greet.invocation(0).faster_than(50)
+
+    def test_faster_than_needs_timing(self):
+        bob = self.deride.wrap(Person('bob'))
+        bob.expect.greet.called.faster_than(1)
+        bob.greet(Person('alice'))
+        with self.assertRaises(RecordingError):
+            bob.expect.greet.called.faster_than(1)
+
+    def test_sink_and_replay(self):
+        stream = io.StringIO()
+        sink = InvocationSink(stream, buffer_size=2)
+        ledger = self.deride.wrap(Ledger({'a': 10, 'b': 20}), sink=sink)
+        ledger.balance('a')
+        ledger.balance('b', currency='EUR')
+        self.assertEqual(len(stream.getvalue().splitlines()), 2)
+        with self.assertRaises(KeyError):
+            ledger.balance('c')
+        ledger.balance('a')
+        sink.close()
+
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[1]['kwargs'], {'currency': 'EUR'})
+        self.assertEqual(records[1]['result'],
+                         {'amount': 20, 'currency': 'EUR'})
+        self.assertIn('KeyError', records[2]['error'])
+
+        stream.seek(0)
+        offline = Ledger({})
+        replayed = self.deride.replay(stream, self.deride.wrap(offline))
+        self.assertEqual(replayed.balance('a'),
+                         {'amount': 10, 'currency': 'GBP'})
+        self.assertEqual(replayed.balance('b', currency='EUR'),
+                         {'amount': 20, 'currency': 'EUR'})
+        self.assertEqual(offline.lookups, 0)
+        with self.assertRaises(KeyError):
+            replayed.balance('c')
+
+    def test_replay_keeps_argument_types(self):
+        stream = io.StringIO()
+        sink = InvocationSink(stream)
+        cursor = self.deride.wrap(Cursor(), sink=sink)
+        cursor.execute((1, 2))
+        cursor.execute([1, 2])
+        cursor.execute({1: 'one'})
+        cursor.execute(decimal.Decimal('1.5'))
+        cursor.execute(((1, 2), {3}))
+        sink.close()
+
+        stream.seek(0)
+        offline = Cursor()
+        offline.execute = lambda sql: 'original'
+        replayed = self.deride.replay(stream, self.deride.wrap(offline))
+        self.assertEqual(replayed.execute((1, 2)), [(1, 2)])
+        self.assertEqual(replayed.execute([1, 2]), [[1, 2]])
+        self.assertEqual(replayed.execute({1: 'one'}), [{1: 'one'}])
+        self.assertEqual(replayed.execute(decimal.Decimal('1.5')),
+                         "[Decimal('1.5')]")
+        self.assertEqual(replayed.execute(((1, 2), {3})), [((1, 2), {3})])
+        self.assertEqual(replayed.execute([1, 2, 3]), 'original')
+
+    def test_specific_with_matchers(self):
+        ledger = self.deride.wrap(Ledger({}))
+        ledger.setup.balance.when(Any(str), currency=Any()) \
+            .to_do_this(lambda account, currency: 'any')
+        ledger.setup.balance.when(Regex('^user-'), currency='GBP') \
+            .to_do_this(lambda account, currency: 'user')
+        ledger.setup.balance.when(Predicate(lambda account: account == 1),
+                                  currency=Any()) \
+            .to_do_this(lambda account, currency: 'one')
+        ledger.setup.balance.when('user-1', currency='GBP') \
+            .to_do_this(lambda account, currency: 'exact')
+
+        self.assertEqual(ledger.balance('user-1', currency='GBP'), 'exact')
+        self.assertEqual(ledger.balance('user-2', currency='GBP'), 'user')
+        self.assertEqual(ledger.balance('user-2', currency='EUR'), 'any')
+        self.assertEqual(ledger.balance('admin', currency='GBP'), 'any')
+        self.assertEqual(ledger.balance(1, currency='GBP'), 'one')
+        with self.assertRaises(KeyError):
+            ledger.balance(2, currency='GBP')
+
+    def test_specific_matchers_by_type(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        bob.setup.pay.when(Any(Person), Any(int, float)).to_return('number')
+        bob.setup.pay.when(alice, Any(float)).to_return('alice float')
+
+        self.assertEqual(bob.pay(Person('carol'), 1), 'number')
+        self.assertEqual(bob.pay(alice, 1), 'number')
+        self.assertEqual(bob.pay(alice, 1.0), 'alice float')
+        self.assertEqual(bob.pay(alice, '1'), None)
+
+    def test_specific_matchers_by_several_types(self):
+        pay = self.deride.func()
+        pay.setup.when(Any(int), 'a').to_return('int a')
+        pay.setup.when(Any(int, str), 'b').to_return('int or str b')
+        pay.setup.when(Any(int, str), 1).to_return('int or str 1')
+        pay.setup.when(Any(int), 1).to_return('int 1')
+
+        self.assertEqual(pay(1, 'a'), 'int a')
+        self.assertEqual(pay('x', 'a'), None)
+        self.assertEqual(pay('x', 'b'), 'int or str b')
+        self.assertEqual(pay(1, 'b'), 'int or str b')
+        self.assertEqual(pay('s', 1), 'int or str 1')
+        self.assertEqual(pay(2, 1), 'int 1')
+
+    def test_with_match(self):
+        ledger = self.deride.wrap(Ledger({'user-1': 1}))
+        ledger.balance('user-1', currency='GBP')
+
+        ledger.expect.balance.called.with_match('^user-')
+        ledger.expect.balance.called.with_args(Regex('1$'))
+        ledger.expect.balance.called.with_args_strict(Any(str))
+        ledger.expect.balance.called.with_all([Any(str)])
+        ledger.expect.balance.called.with_sequence([Regex('user')])
+        with self.assertRaises(AssertionError):
+            ledger.expect.balance.called.with_match('^admin-')
+        with self.assertRaises(AssertionError):
+            ledger.expect.balance.called.with_args_strict(Any(int))
+
     def test_invocations_access(self):
         bob = Person('bob')
         alice = Person('alice')
@@ -334,5 +1113,711 @@ class TestDeride(unittest.TestCase):
         bob.expect.greet.invocation(1).with_arg(alice)
         bob.expect.greet.invocation(2).with_arg(bob)
 
+    def test_stats_do_not_change_after_being_read(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        bob.greet(alice)
+
+        greet = bob.expect.greet
+        bob.greet(alice)
+
+        greet.called.once()
+        bob.expect.greet.called.twice()
+        with self.assertRaises(IndexError):
+            greet.invocation(1)
+
+    def test_method_proxy_is_cached(self):
+        bob = self.deride.wrap(Person('bob'))
+        self.assertIs(bob.greet, bob.greet)
+
+    def test_method_proxy_follows_rebound_target(self):
+        target = Person('bob')
+        bob = self.deride.wrap(target)
+        alice = Person('alice')
+        bob.greet(alice)
+
+        target.greet = lambda other: 'yo ' + other.name
+        self.assertEquals(bob.greet(alice), 'yo alice')
+
+        target.greet = 'not callable'
+        self.assertEquals(bob.greet, 'not callable')
+
+    def test_method_proxy_follows_replaced_setup(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        bob.setup.greet.to_return('foobar')
+        self.assertEquals(bob.greet(alice), 'foobar')
+
+        bob.setup = type(bob.setup)()
+        self.assertEquals(bob.greet(alice), 'hello alice')
+
+    def test_reset_then_record(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        bob.greet(alice)
+        bob.expect.reset()
+        bob.greet(alice)
+
+        bob.expect.greet.called.once()
+
+
+class TestDeep(unittest.TestCase):
+
+    def setUp(self):
+        self.deride = Deride()
+
+    def test_wraps_returned_collaborators(self):
+        db = self.deride.wrap(Database(), deep=True)
+        connection = db.connect()
+        cursor = connection.cursor()
+
+        self.assertEqual(cursor.execute('select 1'), ['select 1'])
+        self.assertEqual(db.name(), 'db')
+        connection.expect.cursor.called.once()
+        cursor.expect.execute.called.with_args('select 1')
+        self.assertIsInstance(connection.target, Connection)
+
+    def test_same_collaborator_same_wrapper(self):
+        db = self.deride.wrap(Database(), deep=True)
+
+        connection = db.connect()
+
+        self.assertIs(db.connect(), connection)
+        db.connect().commit()
+        connection.expect.commit.called.once()
+
+    def test_timeline_traces_call_chains(self):
+        db = self.deride.wrap(Database(), deep=True)
+        connection = db.connect()
+        cursor = connection.cursor()
+        cursor.execute('select 1')
+        connection.commit()
+
+        self.assertEqual(Deride.timeline_of(db).trace(), [
+            'Database.connect',
+            'Database.connect().cursor',
+            'Database.connect().cursor().execute',
+            'Database.connect().commit',
+        ])
+
+    def test_deep_predicate(self):
+        db = self.deride.wrap(
+            Database(), deep=lambda value: isinstance(value, Connection))
+        connection = db.connect()
+
+        self.assertIsInstance(connection.cursor(), Cursor)
+        connection.expect.cursor.called.once()
+
+    def test_values_are_not_wrapped(self):
+        Pair = namedtuple('Pair', 'left right')
+        values = [decimal.Decimal('1.5'), datetime.datetime(2020, 1, 1),
+                  OrderedDict(a=1), Pair(1, 2), Point(1, 2)]
+        cursor = self.deride.wrap(Cursor(), deep=True)
+        cursor.setup.execute.to_return_sequence(values)
+
+        for expected in values:
+            self.assertIs(cursor.execute(''), expected)
+        cursor.expect.execute.called.times(5)
+
+    def test_fluent_methods_return_the_wrapper(self):
+        class Query(object):
+
+            def where(self, clause):
+                return self
+
+            def limit(self, rows):
+                return self
+
+        query = self.deride.wrap(Query(), deep=True)
+
+        self.assertIs(query.where(1).limit(5), query)
+        query.expect.where.called.once()
+        query.expect.limit.called.once()
+
+    def test_shallow_by_default(self):
+        db = self.deride.wrap(Database())
+
+        self.assertIsInstance(db.connect(), Connection)
+        self.assertIsNone(Deride.timeline_of(Deride.wrap(Database())))
+
+
+class TestTimeline(unittest.TestCase):
+
+    def setUp(self):
+        self.deride = Deride()
+
+    def test_order_across_wrappers(self):
+        db = self.deride.wrap(Connection())
+        cache = self.deride.wrap(Ledger({}))
+        db.cursor()
+        db.commit()
+        with self.assertRaises(KeyError):
+            cache.balance('acc')
+
+        self.deride.expect.order(db.commit, cache.balance)
+        self.deride.expect.order(db.cursor, db.commit, cache.balance)
+        with self.assertRaises(AssertionError):
+            self.deride.expect.order(cache.balance, db.commit)
+
+    def test_order_with_stubs_and_spies(self):
+        bob = self.deride.stub(Person)
+        log = self.deride.func()
+        bob.greet(Person('alice'))
+        log('greeted')
+
+        self.deride.expect.order(bob.greet, log)
+        with self.assertRaises(AssertionError):
+            self.deride.expect.order(log, bob.greet)
+
+    def test_since_and_of(self):
+        bob = self.deride.wrap(Person('bob'))
+        carol = self.deride.wrap(Person('carol'))
+        alice = Person('alice')
+        bob.greet(alice)
+        mark = self.deride.expect.checkpoint()
+        carol.greet(alice)
+        bob.pay(alice, 10)
+
+        self.deride.expect.since(mark).order(carol.greet, bob.pay)
+        with self.assertRaises(AssertionError):
+            self.deride.expect.since(mark).order(bob.greet)
+        self.assertEqual(
+            [invocation.name
+             for invocation in self.deride.expect.of(bob).invocations],
+            ['greet', 'pay'])
+
+    def test_order_in_threads(self):
+        bob = self.deride.wrap(Person('bob'), threadsafe=True)
+        alice = Person('alice')
+
+        def greet():
+            for _ in range(1000):
+                bob.greet(alice)
+
+        workers = [threading.Thread(target=greet) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        bob.pay(alice, 10)
+
+        self.assertEqual(len(self.deride.expect.invocations), 4001)
+        self.deride.expect.order(bob.greet, bob.pay)
+
+    def test_class_wraps_have_no_timeline(self):
+        bob = Deride.wrap(Person('bob'))
+        bob.greet(Person('alice'))
+
+        self.assertIsNone(Deride.timeline_of(bob))
+        self.assertEqual(self.deride.expect.invocations, [])
+
+
+class TestLifecycle(unittest.TestCase):
+
+    def setUp(self):
+        self.deride = Deride()
+
+    def test_weak_snapshot(self):
+        bob = self.deride.wrap(Person('bob'), snapshot='weak')
+        alice = Person('alice')
+        bob.greet(alice)
+
+        bob.expect.greet.called.with_args(alice)
+        bob.expect.greet.called.with_args(Any(Person))
+        bob.expect.greet.called.with_args_strict(alice)
+        self.assertIs(bob.expect.greet.invocations[0].args[0](), alice)
+
+        del alice
+        gc.collect()
+        self.assertIsNone(bob.expect.greet.invocations[0].args[0]())
+
+    def test_weak_snapshot_keeps_values_without_weakrefs(self):
+        bob = self.deride.wrap(Person('bob'), snapshot='weak')
+        bob.pay(Person('alice'), 10)
+
+        bob.expect.pay.called.with_arg(10)
+
+    def test_weak_snapshot_matches_temporary_expected_args(self):
+        bob = self.deride.wrap(Person('bob'), snapshot='weak')
+        point = Point(1, 2)
+        bob.credit_with(point)
+
+        bob.expect.credit_with.called.with_args(Point(1, 2))
+        bob.expect.credit_with.called.with_args_strict(Point(1, 2))
+        bob.expect.credit_with.called.with_all([Point(1, 2)])
+        bob.expect.credit_with.called.with_sequence([(Point(1, 2),)])
+
+    def test_released_with_wrapper(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = self.deride.wrap(Person('alice'), snapshot='weak')
+        bob.greet(alice)
+        alice.greet(bob)
+
+        self.assertEqual(self.deride.stats()['wrappers'], 2)
+        self.assertEqual(self.deride.stats()['timeline'], 4)
+        del bob
+        gc.collect()
+
+        stats = self.deride.stats()
+        self.assertEqual(stats['wrappers'], 1)
+        self.assertEqual(stats['timeline'], 2)
+        self.assertEqual(stats['invocations'], 2)
+        self.assertEqual([invocation.name
+                          for invocation in self.deride.expect.invocations],
+                         ['name', 'greet'])
+
+    def test_stats(self):
+        bob = self.deride.wrap(Person('bob'))
+        log = self.deride.func()
+        stub = self.deride.stub(Person)
+        alice = Person('alice')
+        for amount in range(10):
+            bob.pay(alice, amount)
+        log('paid')
+        stub.greet(alice)
+
+        stats = self.deride.stats()
+        self.assertEqual(stats['wrappers'], 3)
+        self.assertEqual(stats['invocations'], 12)
+        self.assertEqual(stats['timeline'], 12)
+        self.assertGreater(stats['bytes'], 0)
+        del bob
+        self.assertLess(self.deride.stats()['bytes'], stats['bytes'])
+
+    def test_timeline_follows_record_mode(self):
+        bob = self.deride.wrap(Person('bob'), record='counts')
+        alice = Person('alice')
+        payload = 'x' * 10000
+        for _ in range(1000):
+            bob.pay(alice, payload)
+
+        bob.expect.pay.called.times(1000)
+        self.assertEqual(self.deride.stats()['timeline'], 0)
+        self.assertLess(self.deride.stats()['bytes'], 1000 * len(payload))
+        self.assertRaises(AssertionError, self.deride.expect.order, bob.pay)
+
+    def test_timeline_released_on_reset_and_trim(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        bob.greet(alice)
+        mark = bob.expect.checkpoint()
+        carol = Person('carol')
+        bob.greet(carol)
+        log = self.deride.func()
+        log('greeted')
+
+        bob.expect.trim(mark)
+        self.assertEqual([invocation.args for invocation
+                          in self.deride.expect.invocations],
+                         [(carol,), ('greeted',)])
+        bob.expect.reset()
+        self.assertEqual(self.deride.stats()['timeline'], 1)
+        bob.expect.greet.called.never()
+
+    def test_timeline_released_on_method_reset(self):
+        bob = self.deride.wrap(Person('bob'))
+        alice = Person('alice')
+        payload = 'x' * 10000
+        bob.greet(alice)
+        bob.pay(alice, payload)
+        log = self.deride.func()
+        log('paid')
+
+        bob.expect.pay.called.reset()
+        self.assertEqual([invocation.args for invocation
+                          in self.deride.expect.invocations],
+                         [(alice,), ('paid',)])
+        self.assertRaises(AssertionError, self.deride.expect.order, bob.pay)
+        bob.expect.greet.reset()
+        log.expect.called.reset()
+        self.assertEqual(self.deride.stats()['timeline'], 0)
+
+
+class TestProcesses(unittest.TestCase):
+
+    def test_pickled_copy_reports_back(self):
+        ledger = Deride.wrap(Ledger({'acc': 10}), processes=True)
+        copy = pickle.loads(pickle.dumps(ledger))
+
+        self.assertEqual(copy.balance('acc')['amount'], 10)
+        copy.expect.balance.called.once()
+        copy.expect.flush()
+
+        ledger.expect.balance.called.once()
+        ledger.expect.balance.called.with_args('acc')
+
+    def test_copies_share_a_connection(self):
+        ledger = Deride.wrap(Ledger({'acc': 10}), processes=True)
+        first = pickle.loads(pickle.dumps(ledger))
+        second = pickle.loads(pickle.dumps(ledger))
+
+        self.assertIs(first.expect.connection, second.expect.connection)
+        first.balance('acc')
+        second.balance('acc')
+        first.expect.flush()
+        second.expect.flush()
+        ledger.expect.balance.called.twice()
+
+    def test_collector_thread_stops_when_released(self):
+        threads = threading.active_count()
+        for _ in range(5):
+            Deride.wrap(Ledger({}), processes=True)
+        gc.collect()
+
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_only_process_wrappers_pickle(self):
+        with self.assertRaises(TypeError):
+            pickle.dumps(Deride.wrap(Ledger({})))
+
+    def test_unpicklable_values_sent_as_repr(self):
+        ledger = Deride.wrap(Ledger({'acc': 10}), processes=True)
+        copy = pickle.loads(pickle.dumps(ledger))
+
+        copy.balance('acc', currency=lambda: None)
+        copy.expect.flush()
+
+        ledger.expect.balance.called.with_args('acc')
+        self.assertIsInstance(ledger.expect.balance.invocation(0)
+                              .invocations[0].kwargs['currency'], str)
+
+    def test_process_pool(self):
+        ledger = Deride.wrap(Ledger({'acc': 10}), processes=True)
+        ledger.balance('acc', 'EUR')
+
+        with ProcessPoolExecutor(2) as pool:
+            balances = list(pool.map(methodcaller('balance', 'acc'),
+                                     [ledger] * 4))
+
+        self.assertEqual([balance['amount'] for balance in balances],
+                         [10] * 4)
+        ledger.expect.balance.called.times(5)
+        ledger.expect.balance.called.with_args('acc', 'EUR')
+
+    def test_idle_copy_flushes_while_pool_runs(self):
+        ledger = Deride.wrap(Ledger({'acc': 10}), processes=True)
+
+        with ProcessPoolExecutor(1) as pool:
+            pool.submit(methodcaller('balance', 'acc'), ledger).result()
+            for _ in range(100):
+                try:
+                    ledger.expect.balance.called.once()
+                    break
+                except AssertionError:
+                    time.sleep(0.05)
+            ledger.expect.balance.called.once()
+
+    def test_copies_released_once_collected(self):
+        ledger = Deride.wrap(Ledger({'acc': 10}), processes=True)
+        refs = []
+        for _ in range(50):
+            copy = pickle.loads(pickle.dumps(ledger))
+            copy.balance('acc')
+            refs.append(weakref.ref(copy.expect))
+        del copy
+        gc.collect()
+
+        self.assertEqual([ref() for ref in refs], [None] * 50)
+        ledger.expect.balance.called.times(50)
+
+
+class TestAttributes(unittest.TestCase):
+
+    def setUp(self):
+        self.deride = Deride()
+
+    def test_property_reads(self):
+        config = self.deride.wrap(Config())
+
+        self.assertEqual(config.settings, {'debug': False})
+        self.assertEqual(config.settings, {'debug': False})
+        config.expect.settings.read.twice()
+        config.expect.settings.called.twice()
+        self.assertEqual(config.target.loads, 2)
+
+    def test_property_to_return(self):
+        config = self.deride.wrap(Config())
+        config.setup.settings.to_return({'debug': True})
+
+        self.assertEqual(config.settings, {'debug': True})
+        config.expect.settings.read.once()
+
+    def test_property_to_do_this_skips_read(self):
+        config = self.deride.wrap(Config())
+        config.setup.settings.to_do_this(lambda: {'debug': True})
+
+        self.assertEqual(config.settings, {'debug': True})
+        self.assertEqual(config.target.loads, 0)
+
+    def test_property_writes(self):
+        config = self.deride.wrap(Config())
+        config.timeout = 30
+
+        self.assertEqual(config.target.timeout, 30)
+        self.assertEqual(config.timeout, 30)
+        config.expect.timeout.written.once()
+        config.expect.timeout.written.with_args(30)
+        config.expect.timeout.read.once()
+
+    def test_instance_attributes(self):
+        bob = self.deride.wrap(Person('bob'))
+        bob.setup.name.when().to_return('robert')
+
+        self.assertEqual(bob.name, 'robert')
+        bob.name = 'rob'
+        self.assertEqual(bob.target.name, 'rob')
+        bob.expect.name.read.once()
+        bob.expect.name.written.with_args('rob')
+        Deride.wrap(Person('carol')).expect.name.written.never()
+
+    def test_writes_since_checkpoint(self):
+        config = self.deride.wrap(Config())
+        config.timeout = 30
+        mark = config.expect.checkpoint()
+        config.timeout = 60
+
+        config.expect.since(mark).timeout.written.once()
+        config.expect.since(mark).timeout.written.with_args(60)
+        with self.assertRaises(AssertionError):
+            config.expect.since(mark).timeout.written.with_args(30)
+
+    def test_properties_named_as_wrapper_attributes(self):
+        class Column(object):
+
+            def __init__(self):
+                self.value = 0
+
+            @property
+            def setter(self):
+                return 'column setter'
+
+            @property
+            def foo(self):
+                return self.value
+
+            @foo.setter
+            def foo(self, value):
+                self.value = value
+
+        column = self.deride.wrap(Column())
+        column.foo = 3
+
+        self.assertEqual(column.foo, 3)
+        self.assertEqual(column.setter, 'column setter')
+        column.expect.foo.written.with_args(3)
+        column.expect.setter.read.once()
+
+    def test_target_members_named_as_deride_attributes(self):
+        class Graph(object):
+            timeline = 'graph timeline'
+
+            def of(self, node):
+                return [node]
+
+            def collaborator(self):
+                return 'graph collaborator'
+
+            def setter(self, name):
+                return 'set ' + name
+
+        graph = self.deride.wrap(Graph(), deep=True)
+
+        self.assertEqual(graph.of(1), [1])
+        self.assertEqual(graph.collaborator(), 'graph collaborator')
+        self.assertEqual(graph.setter('x'), 'set x')
+        self.assertEqual(graph.timeline, 'graph timeline')
+        graph.expect.of.called.once()
+        graph.expect.timeline.read.once()
+
+    def test_wrapper_class_per_target_class(self):
+        first = self.deride.wrap(Config())
+        second = self.deride.wrap(Config())
+
+        self.assertIs(type(first), type(second))
+        self.assertEqual(type(first).__name__, 'ConfigWrapper')
+        self.assertIs(type(self.deride.wrap(Person('bob'))),
+                      type(self.deride.wrap(Person('alice'))))
+
+
+class TestStub(unittest.TestCase):
+
+    def setUp(self):
+        self.deride = Deride()
+
+    def test_stub_methods_do_nothing(self):
+        bob = self.deride.stub(Person)
+        alice = Person('alice')
+
+        self.assertIsNone(bob.greet(alice))
+        bob.expect.greet.called.once()
+        bob.expect.greet.called.with_arg(alice)
+        bob.expect.pay.called.never()
+
+    def test_stub_setup(self):
+        bob = self.deride.stub(Person)
+        alice = Person('alice')
+        bob.setup.greet.to_return('hello')
+        bob.setup.greet.when(alice).to_return('hello alice')
+
+        self.assertEqual(bob.greet(bob), 'hello')
+        self.assertEqual(bob.greet(alice), 'hello alice')
+
+    def test_stub_class_is_shared(self):
+        bob = self.deride.stub(Person)
+        alice = self.deride.stub(Person)
+
+        self.assertIs(type(bob), type(alice))
+        self.assertIn('greet', vars(type(bob)))
+        self.assertFalse(hasattr(bob, '__dict__'))
+        bob.greet(alice)
+        alice.expect.greet.called.never()
+
+    def test_stub_methods_named_as_deride_attributes(self):
+        class Query(object):
+
+            def timeline(self):
+                return []
+
+            def of(self):
+                return []
+
+            def where(self, clause):
+                return self
+
+        query = self.deride.stub(Query)
+        query.where(1)
+
+        self.assertIsNone(query.timeline())
+        self.assertIsNone(query.of())
+        self.assertIs(Deride.timeline_of(query), self.deride.timeline)
+        query.expect.timeline.called.once()
+        query.expect.where.called.once()
+
+    def test_stub_coroutine_methods(self):
+        bob = self.deride.stub(AsyncPerson)
+        bob.setup.fetch.to_resolve_with('fetched')
+
+        self.assertEqual(run(bob.fetch(Person('alice'))), 'fetched')
+        bob.expect.fetch.called.once()
+
+
+class TestFunc(unittest.TestCase):
+
+    def setUp(self):
+        self.deride = Deride()
+
+    def test_func_does_nothing(self):
+        func = self.deride.func()
+
+        self.assertIsNone(func(1, a=2))
+        func.expect.called.once()
+        func.expect.called.with_args_strict(1)
+        func.expect.invocation(0).with_arg(1)
+
+    def test_func_spies_on_function(self):
+        func = self.deride.func(lambda value: value * 2)
+        func(1)
+        func(2)
+
+        self.assertEqual(func(3), 6)
+        func.expect.called.times(3)
+        func.expect.called.with_sequence([1, 3])
+
+    def test_func_setup(self):
+        func = self.deride.func(lambda value: value * 2)
+        func.setup.when(2).to_return(5)
+        func.setup.when(Any(str)).to_raise(TypeError('not a number'))
+
+        self.assertEqual(func(1), 2)
+        self.assertEqual(func(2), 5)
+        with self.assertRaises(TypeError):
+            func('1')
+
+    def test_func_records_counts(self):
+        func = self.deride.func(record='counts')
+        for value in range(10):
+            func(value)
+
+        func.expect.called.times(10)
+        with self.assertRaises(RecordingError):
+            func.expect.called.with_arg(1)
+
+
+class TestDerideAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.deride = Deride()
+
+    def test_wraps_coroutine_methods(self):
+        target = AsyncPerson('bob')
+        bob = self.deride.wrap(target)
+        alice = Person('alice')
+
+        self.assertEqual(run(bob.fetch(alice)), 'fetched alice')
+        bob.expect.fetch.called.once()
+        bob.expect.fetch.called.with_arg(alice)
+
+    def test_to_return_awaits_original(self):
+        target = AsyncPerson('bob')
+        bob = self.deride.wrap(target)
+        bob.setup.fetch.to_return('foobar')
+
+        self.assertEqual(run(bob.fetch(Person('alice'))), 'foobar')
+        self.assertEqual(target.fetched, 1)
+
+    def test_to_intercept_with_coroutine(self):
+        bob = self.deride.wrap(AsyncPerson('bob'))
+        intercepted = []
+
+        async def intercept(other):
+            intercepted.append(other.name)
+
+        bob.setup.fetch.to_intercept_with(intercept)
+
+        self.assertEqual(run(bob.fetch(Person('alice'))),
+                         'fetched alice')
+        self.assertEqual(intercepted, ['alice'])
+
+    def test_to_resolve_with(self):
+        target = AsyncPerson('bob')
+        bob = self.deride.wrap(target)
+        bob.setup.fetch.to_resolve_with('foobar')
+
+        self.assertEqual(run(bob.fetch(Person('alice'))), 'foobar')
+        self.assertEqual(target.fetched, 0)
+
+    def test_to_return_sequence_resolves(self):
+        target = AsyncPerson('bob')
+        bob = self.deride.wrap(target)
+        bob.setup.fetch.to_return_sequence(['a', 'b'])
+        alice = Person('alice')
+
+        self.assertEqual(run(bob.fetch(alice)), 'a')
+        self.assertEqual(run(bob.fetch(alice)), 'b')
+        self.assertEqual(target.fetched, 0)
+
+    def test_to_reject_with(self):
+        bob = self.deride.wrap(AsyncPerson('bob'))
+        bob.setup.fetch.to_reject_with(ValueError('something went wrong'))
+
+        with self.assertRaises(ValueError):
+            run(bob.fetch(Person('alice')))
+        bob.expect.fetch.called.once()
+
+    def test_records_in_completion_order(self):
+        bob = self.deride.wrap(AsyncPerson('bob'))
+        alice = Person('alice')
+        carol = Person('carol')
+        bob.setup.fetch.when(alice).to_resolve_with('slow', latency=0.02)
+        bob.setup.fetch.when(carol).to_resolve_with('fast', latency=0.01)
+
+        async def fetch_both():
+            return await asyncio.gather(bob.fetch(alice), bob.fetch(carol))
+
+        self.assertEqual(run(fetch_both()), ['slow', 'fast'])
+        bob.expect.fetch.invocation(0).with_arg(carol)
+        bob.expect.fetch.invocation(1).with_arg(alice)
+
+
 if __name__ == '__main__':
     unittest.main()